@@ -1,6 +1,7 @@
 """Common functions / classes used by all modules."""
 
 import datetime
+import calendar
 
 def parse_date(str, type=datetime.datetime):
     try:
@@ -29,6 +30,85 @@ def ensure_date(s, type=datetime.datetime):
         return s
 
 
+SECONDS_IN_DAY = 60 * 60 * 24
+
+
+def epoch_day(seconds):
+    """Return start of utc day containing seconds since epoch."""
+    return seconds - seconds % SECONDS_IN_DAY
+
+
+def datetime_to_epoch(d):
+    """Return seconds since epoch of utc datetime d."""
+    return calendar.timegm(d.timetuple())
+
+
+def epoch_to_datetime(seconds):
+    """Return utc datetime of seconds since epoch."""
+    return datetime.datetime.utcfromtimestamp(seconds)
+
+
+# date part of svn date: (year, month, day, seconds since epoch)
+_days = {}
+
+def parse_svn_date(s):
+    """Parse svn log date, like 2005-01-01T07:00:00.000000Z.
+
+    Return (datetime, seconds since epoch) tuple. Most revisions share
+    their day with others, so date part is parsed once for each day.
+    """
+    if len(s) < 19:
+        d = parse_date(s)
+        return d, datetime_to_epoch(d)
+    day = _days.get(s[:10])
+    if day is None:
+        year, month, mday = int(s[0:4]), int(s[5:7]), int(s[8:10])
+        day = _days[s[:10]] = (year, month, mday,
+            calendar.timegm((year, month, mday, 0, 0, 0)))
+    hour, minute, second = int(s[11:13]), int(s[14:16]), int(s[17:19])
+    return (datetime.datetime(day[0], day[1], day[2], hour, minute, second),
+        day[3] + hour * 3600 + minute * 60 + second)
+
+
+def _add_months(d, months):
+    month = d.month - 1 + months
+    return d.replace(year=d.year + month // 12, month=month % 12 + 1, day=1)
+
+
+# calendar type: (start of period containing day, start of next period)
+calendar_periods = {
+    'day': (
+        lambda d: d,
+        lambda d: d + datetime.timedelta(days=1)),
+    'week': (
+        lambda d: d - datetime.timedelta(days=d.weekday()),
+        lambda d: d + datetime.timedelta(days=7)),
+    'month': (
+        lambda d: d.replace(day=1),
+        lambda d: _add_months(d, 1)),
+    'quarter': (
+        lambda d: d.replace(month=(d.month - 1) // 3 * 3 + 1, day=1),
+        lambda d: _add_months(d, 3)),
+    'year': (
+        lambda d: d.replace(month=1, day=1),
+        lambda d: d.replace(year=d.year + 1)),
+}
+
+calendar_types = ('day', 'week', 'month', 'quarter', 'year')
+
+
+def iter_periods(calendar_type, first, last):
+    """Yield (start, end) of calendar_type periods (weeks start on
+    monday, like iso weeks) covering time from first to last.
+    """
+    period_start, next_period = calendar_periods[calendar_type]
+    start = period_start(datetime.datetime(first.year, first.month, first.day))
+    while start <= last:
+        end = next_period(start)
+        yield start, end
+        start = end
+
+
 def make_colors(collection):
     """Create different colors for each value."""
     saturation = 1.0
@@ -2,3 +2,4 @@
 
 db_connection_params = ('sqlite', None, None, 'mpyss.sqlite', None, None)
 
+svn_binary = 'svn'
@@ -1,12 +1,19 @@
 #!/usr/bin/env python2.4
 # coding: utf-8
 
-import sys, os, time
+import sys, os, time, re
+import datetime
+import posixpath
 import string
 
 import udb
 
 import config
+from common import ensure_date, datetime_to_epoch, epoch_day, SECONDS_IN_DAY
+
+
+MIGRATION_CHUNK_SIZE = 10000
+
 
 def connect():
     """Connect to database."""
@@ -71,7 +78,451 @@ def __table_exists(conn, table_name):
         raise Exception()
 
 
-def create_db_if_needed(conn):
-    if not conn.table_exists('revision'):
-        conn.execute_script(file('mpyss.sql').read())
+re_create_index = re.compile(r'^create\s+index\s+(\w+)\s', re.IGNORECASE)
+re_create = re.compile(
+    r'^create\s+(?:unique\s+)?(table|index|view)\s+(\w+)(?:\s+on\s+(\w+))?',
+    re.IGNORECASE)
+
+
+def _read_schema():
+    """Return list of sql commands from mpyss.sql."""
+    return [s.strip() for s in file('mpyss.sql').read().split(';') if s.strip()]
+
+
+def create_db_if_needed(conn, with_indexes=True):
+    """Create tables if database is empty, upgrade databases
+    created by older versions (see migrate).
+    Secondary indexes can be left out, for loading data
+    faster - see create_indexes.
+    """
+    # revision is renamed to revision_old while it is migrated
+    if not (conn.table_exists('revision') or conn.table_exists('revision_old')):
+        for cmd in _read_schema():
+            if with_indexes or not re_create_index.match(cmd):
+                conn.execute_script(cmd)
+        _set_schema_version(conn, migrations[-1][0])
+        return
+    migrate(conn)
+
+
+def get_schema_version(conn):
+    """Return version of database schema, 0 for databases created
+    before versions were recorded.
+    """
+    if not conn.table_exists('schema_version'):
+        return 0
+    curs = conn.cursor()
+    curs.execute('select max(sv_version) from schema_version')
+    return curs.fetchone()[0] or 0
+
+
+def _set_schema_version(conn, version):
+    curs = conn.cursor()
+    curs.execute('delete from migration_progress')
+    curs.execute(
+        'insert into schema_version (sv_version, sv_timestamp) values ($version, $timestamp)',
+        {'version': version, 'timestamp': datetime.datetime.now()})
+    conn.commit()
+
+
+def migrate(conn):
+    """Apply migrations newer than schema version of database.
+
+    Every migration is recorded when done. Backfills commit their
+    progress after each chunk (see _revision_chunks), so migration
+    interrupted on large database continues where it stopped.
+    """
+    if not conn.table_exists('schema_version'):
+        _create_objects(conn, ('schema_version', 'migration_progress'))
+    version = get_schema_version(conn)
+    for migration_version, description, upgrade in migrations:
+        if migration_version <= version:
+            continue
+        print >>sys.stderr, "migrating to schema version %d: %s" % (migration_version, description)
+        upgrade(conn)
+        _set_schema_version(conn, migration_version)
+
+
+def _revision_chunks(conn, name, chunk_size=MIGRATION_CHUNK_SIZE):
+    """Yield (repo_id, start, end) ranges of revisions to process,
+    rv_number > start and rv_number <= end, in primary key order.
+
+    Position is saved as progress of backfill name and committed
+    when next range is requested, and ranges before saved position
+    are not yielded again.
+    """
+    curs = conn.cursor()
+    curs.execute(
+        'select mp_position from migration_progress where mp_name = $name',
+        {'name': name})
+    row = curs.fetchone()
+    saved_repo_id, saved_number = 0, 0
+    if row is not None:
+        saved_repo_id, saved_number = map(int, row[0].split(':'))
+    curs.execute('''
+        select rp_id, max(rv_number)
+        from revision
+        group by rp_id
+        order by rp_id
+    ''')
+    for repo_id, max_number in curs.fetchall():
+        if repo_id < saved_repo_id:
+            continue
+        start = 0
+        if repo_id == saved_repo_id:
+            start = saved_number
+        while start < max_number:
+            end = start + chunk_size
+            yield repo_id, start, end
+            params = {'name': name, 'position': '%d:%d' % (repo_id, end)}
+            curs.execute('delete from migration_progress where mp_name = $name',
+                params)
+            curs.execute('''
+                insert into migration_progress (mp_name, mp_position)
+                values ($name, $position)
+            ''', params)
+            conn.commit()
+            start = end
+
+
+def _add_fingerprints(conn):
+    if not conn.column_exists('revision', 'rv_fingerprint'):
+        conn.execute_script('alter table revision add rv_fingerprint varchar(40)')
+
+
+def _create_ingest_checkpoint(conn):
+    if not conn.table_exists('ingest_checkpoint'):
+        _create_objects(conn, ('ingest_checkpoint',))
+
+
+def _add_author_days(conn):
+    if not conn.table_exists('author_day'):
+        _create_objects(conn, ('author_day',))
+    curs = conn.cursor()
+    for repo_id, start, end in _revision_chunks(conn, 'author_day'):
+        curs.execute('''
+            select rv_epoch
+            from revision
+            where rp_id = $repo_id
+            and rv_number > $start and rv_number <= $end
+        ''', {'repo_id': repo_id, 'start': start, 'end': end})
+        days = set([epoch_day(epoch) for (epoch,) in curs.fetchall()])
+        update_author_days(conn, repo_id, days)
+
+
+def _add_report_cache(conn):
+    if not conn.column_exists('repository', 'rp_generation'):
+        conn.execute_script('alter table repository add rp_generation integer default 0')
+    if not conn.table_exists('report_cache'):
+        _create_objects(conn, ('report_cache',))
+
+
+def _add_bulk_load_marker(conn):
+    if not conn.column_exists('repository', 'rp_bulk_load'):
+        conn.execute_script('alter table repository add rp_bulk_load integer default 0')
+
+
+def update_author_days(conn, repo_id, days):
+    """Compute author_day rows of repository repo_id for days (given as
+    seconds since epoch at start of day) again from revision table.
+    """
+    params = [{
+        'repo_id': repo_id,
+        'day': day,
+        'next_day': day + SECONDS_IN_DAY,
+    } for day in sorted(days)]
+    curs = conn.cursor()
+    curs.executemany('''
+        delete from author_day
+        where rp_id = $repo_id and ad_day = $day
+    ''', params)
+    curs.executemany('''
+        insert into author_day (
+            rp_id, au_id, ad_day,
+            ad_commits, ad_paths, ad_msg_length)
+        select rv.rp_id, rv.au_id, $day,
+            count(*),
+            sum((
+                select count(*)
+                from path_change pc
+                where pc.rp_id = rv.rp_id and pc.rv_number = rv.rv_number
+            )),
+            sum(length(rv.rv_comment))
+        from revision rv
+        where rv.rp_id = $repo_id
+        and rv.rv_epoch >= $day and rv.rv_epoch < $next_day
+        group by rv.rp_id, rv.au_id
+    ''', params)
+
+
+def rebuild_author_days(conn, repo_id):
+    """Compute all author_day rows of repository repo_id again."""
+    curs = conn.cursor()
+    curs.execute('delete from author_day where rp_id = $repo_id',
+        {'repo_id': repo_id})
+    curs.execute('select rv_epoch from revision where rp_id = $repo_id',
+        {'repo_id': repo_id})
+    days = set([epoch_day(epoch) for (epoch,) in curs])
+    update_author_days(conn, repo_id, days)
+
+
+def create_calendar_if_needed(conn):
+    """Create calendar table if it is missing. Calendar of older
+    versions (months only, without period ends) is created again,
+    it is filled from revisions anyway.
+    """
+    if conn.table_exists('calendar'):
+        if conn.column_exists('calendar', 'end_timestamp'):
+            return
+        conn.execute_script('drop table calendar')
+    _create_objects(conn, ('calendar',))
+
+
+def _create_objects(conn, table_names):
+    """Create tables and views named in table_names, with their indexes,
+    as defined in mpyss.sql. Objects which exist already (created by
+    interrupted migration) are left alone.
+    """
+    exists = {
+        'table': conn.table_exists,
+        'index': conn.index_exists,
+        'view': conn.view_exists,
+    }
+    for cmd in _read_schema():
+        m = re_create.match(cmd)
+        if m and (m.group(2) in table_names or m.group(3) in table_names):
+            if not exists[m.group(1).lower()](m.group(2)):
+                conn.execute_script(cmd)
+
+
+def _add_surrogate_keys(conn):
+    """Replace repository urls and author names stored in revision
+    and path_change tables by older versions with integer ids.
+
+    Old tables are renamed to revision_old and path_change_old, and
+    dropped after their rows are copied to new tables. sqlite commits
+    before every schema change, so migration interrupted before that
+    finds old tables left and copies them again.
+    """
+    if conn.column_exists('revision', 'rv_repo_url'):
+        for index_name in ('revision_url_author_i', 'revision_url_timestamp_i',
+                'path_change_url_i'):
+            conn.execute_script('drop index if exists %s' % index_name)
+        conn.execute_script('alter table revision rename to revision_old')
+    if not conn.table_exists('revision_old'):
+        return
+    print >>sys.stderr, "moving repository urls and authors to separate tables"
+    if (conn.table_exists('path_change')
+            and conn.column_exists('path_change', 'rv_repo_url')):
+        conn.execute_script('drop view if exists changed_path')
+        conn.execute_script('alter table path_change rename to path_change_old')
+    has_path_change = conn.table_exists('path_change_old')
+    if has_path_change:
+        _create_objects(conn, ('repository', 'author', 'revision',
+            'path_change', 'changed_path'))
+    else:
+        _create_objects(conn, ('repository', 'author', 'revision'))
+    curs = conn.cursor()
+    repositories = NameDictionary(conn, 'repository', 'rp_id', 'rp_url')
+    curs.execute('select distinct rv_repo_url from revision_old')
+    for (url,) in curs.fetchall():
+        repositories.get_id(url)
+    repositories.write_new()
+    authors = NameDictionary(conn, 'author', 'au_id', 'au_name')
+    curs.execute('select distinct coalesce(rv_author, \'\') from revision_old')
+    for (name,) in curs.fetchall():
+        authors.get_id(name)
+    authors.write_new()
+    # rows copied by interrupted migration
+    conn.execute_script('delete from revision')
+    conn.execute_script('''
+        insert into revision (rp_id, rv_number, au_id,
+            rv_timestamp, rv_comment, rv_fingerprint)
+        select rp.rp_id, o.rv_number, au.au_id,
+            o.rv_timestamp, o.rv_comment, o.rv_fingerprint
+        from revision_old o
+        join repository rp on rp.rp_url = o.rv_repo_url
+        join author au on au.au_name = coalesce(o.rv_author, \'\')
+    ''')
+    if has_path_change:
+        conn.execute_script('delete from path_change')
+        conn.execute_script('''
+            insert into path_change (rp_id, rv_number, pt_id, cp_action)
+            select rp.rp_id, o.rv_number, o.pt_id, o.cp_action
+            from path_change_old o
+            join repository rp on rp.rp_url = o.rv_repo_url
+        ''')
+        conn.commit()
+        conn.execute_script('drop table path_change_old')
+    conn.commit()
+    conn.execute_script('drop table revision_old')
+    conn.commit()
+
+
+def _add_epoch_timestamps(conn):
+    """Add rv_epoch column to revision table of older versions, and
+    index it instead of revision number indexed by mistake.
+    """
+    if not conn.column_exists('revision', 'rv_epoch'):
+        conn.execute_script('drop index if exists revision_url_timestamp_i')
+        conn.execute_script('alter table revision add rv_epoch integer')
+    curs = conn.cursor()
+    for repo_id, start, end in _revision_chunks(conn, 'revision.rv_epoch'):
+        curs.execute('''
+            select rv_number, rv_timestamp
+            from revision
+            where rp_id = $repo_id
+            and rv_number > $start and rv_number <= $end
+            and rv_epoch is null
+        ''', {'repo_id': repo_id, 'start': start, 'end': end})
+        curs.executemany('''
+            update revision set rv_epoch = $epoch
+            where rp_id = $repo_id and rv_number = $number
+        ''', [{
+            'repo_id': repo_id,
+            'number': number,
+            'epoch': datetime_to_epoch(ensure_date(timestamp)),
+        } for number, timestamp in curs.fetchall()])
+    create_indexes(conn, ('revision_url_timestamp_i',))
+
+
+def _intern_changed_paths(conn):
+    """Move changed_path table of older versions to path dictionary.
+
+    Old table is renamed to changed_path_old and dropped after its rows
+    are copied, so interrupted migration copies them again.
+    """
+    if conn.table_exists('changed_path'):
+        conn.execute_script('alter table changed_path rename to changed_path_old')
+    if not conn.table_exists('changed_path_old'):
+        return
+    print >>sys.stderr, "moving changed paths to path dictionary"
+    _create_objects(conn, ('path', 'path_change', 'changed_path'))
+    paths = PathDictionary(conn)
+    curs = conn.cursor()
+    curs.execute('select distinct cp_path from changed_path_old')
+    for (path,) in curs.fetchall():
+        paths.get_id(path)
+    paths.write_new()
+    # rows copied by interrupted migration
+    conn.execute_script('delete from path_change')
+    conn.execute_script('''
+        insert into path_change (rp_id, rv_number, pt_id, cp_action)
+        select rp.rp_id, cp.rv_number, pt.pt_id, cp.cp_action
+        from changed_path_old cp
+        join repository rp on rp.rp_url = cp.rv_repo_url
+        join path pt on pt.pt_path = cp.cp_path
+    ''')
+    conn.commit()
+    conn.execute_script('drop table changed_path_old')
+    conn.commit()
+
+
+# schema version, description, function upgrading database from
+# previous version; databases older than schema versions go through
+# all of them, so every migration checks what is left to be done
+migrations = [
+    (1, 'add revision fingerprints', _add_fingerprints),
+    (2, 'move repository urls and authors to separate tables', _add_surrogate_keys),
+    (3, 'move changed paths to path dictionary', _intern_changed_paths),
+    (4, 'add epoch timestamps to revisions', _add_epoch_timestamps),
+    (5, 'add import checkpoints', _create_ingest_checkpoint),
+    (6, 'add calendar periods', create_calendar_if_needed),
+    (7, 'add daily author rollups', _add_author_days),
+    (8, 'add report cache', _add_report_cache),
+    (9, 'add bulk load marker', _add_bulk_load_marker),
+]
+
+
+class NameDictionary(object):
+    """In-memory cache of table mapping names (like author names or
+    repository urls) to integer ids.
+
+    Names not yet in database get new ids, and are remembered
+    until write_new is called.
+    """
+
+    def __init__(self, conn, table, id_column, name_column):
+        self.conn = conn
+        self.table = table
+        self.id_column = id_column
+        self.name_column = name_column
+        self.ids = {}
+        self.new_names = []
+        curs = conn.cursor()
+        curs.execute('select %s, %s from %s' % (name_column, id_column, table))
+        for name, id in curs.fetchall():
+            self.ids[name] = id
+        self.next_id = max([0] + self.ids.values()) + 1
+
+    def _new_id(self, name):
+        id = self.next_id
+        self.next_id += 1
+        self.ids[name] = id
+        return id
+
+    def get_id(self, name):
+        id = self.ids.get(name)
+        if id is None:
+            id = self._new_id(name)
+            self.new_names.append((id, name))
+        return id
+
+    def write_new(self):
+        """Insert names created since last call into database."""
+        curs = self.conn.cursor()
+        curs.executemany(
+            'insert into %s (%s, %s) values ($id, $name)' % (
+                self.table, self.id_column, self.name_column),
+            [{'id': id, 'name': name.encode('utf-8')} for id, name in self.new_names])
+        self.new_names = []
+
+
+class PathDictionary(NameDictionary):
+    """In-memory cache of path table.
+
+    Every distinct path, and every parent directory of it, gets an integer
+    id.
+    """
+
+    def __init__(self, conn):
+        NameDictionary.__init__(self, conn, 'path', 'pt_id', 'pt_path')
+
+    def get_id(self, path):
+        id = self.ids.get(path)
+        if id is None:
+            parent = posixpath.dirname(path)
+            if parent == path:
+                parent_id = None
+            else:
+                parent_id = self.get_id(parent)
+            id = self._new_id(path)
+            self.new_names.append((id, parent_id, path))
+        return id
+
+    def write_new(self):
+        curs = self.conn.cursor()
+        curs.executemany(
+            '''
+                insert into path (pt_id, pt_parent_id, pt_path)
+                values ($id, $parent_id, $path)
+            ''', [{
+                'id': id,
+                'parent_id': parent_id,
+                'path': path.encode('utf-8'),
+            } for id, parent_id, path in self.new_names])
+        self.new_names = []
+
+
+def create_indexes(conn, index_names=None):
+    """Create indexes from mpyss.sql that do not exist yet
+    (only those in index_names, if given).
+    """
+    for cmd in _read_schema():
+        m = re_create_index.match(cmd)
+        if m and index_names is not None and m.group(1) not in index_names:
+            continue
+        if m and not conn.index_exists(m.group(1)):
+            print >>sys.stderr, "creating index %s" % m.group(1)
+            conn.execute_script(cmd)
 
@@ -0,0 +1,254 @@
+"""Fetch logs directly from repository with svn client."""
+
+import os
+import subprocess
+import threading
+import tempfile
+import Queue
+import xml.dom.minidom
+
+
+READ_SIZE = 1024 * 1024
+MAX_QUEUED_BLOCKS = 64
+
+LOG_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<log>\n'
+LOG_FOOTER = '</log>\n'
+
+
+def svn_log_command(svn_binary, repo_url, revision_range=None):
+    """Return argument list running svn log for repo_url."""
+    cmd = [svn_binary, 'log', '-v', '--xml', '--non-interactive']
+    if revision_range:
+        cmd += ['-r', revision_range]
+    cmd.append(repo_url)
+    return cmd
+
+
+class SvnLogReader(object):
+    """File-like object reading output of svn log process.
+
+    Output is read by background thread as soon as svn writes it,
+    so svn keeps fetching while data already read is parsed and stored.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        self.queue = Queue.Queue(MAX_QUEUED_BLOCKS)
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._read_output)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _read_output(self):
+        fd = self.process.stdout.fileno()
+        try:
+            while True:
+                data = os.read(fd, READ_SIZE)
+                self.queue.put(data)
+                if not data:
+                    break
+        except Exception, e:
+            self.queue.put(e)
+
+    def _fill(self):
+        data = self.queue.get()
+        if isinstance(data, Exception):
+            raise data
+        if not data:
+            self.eof = True
+            returncode = self.process.wait()
+            if returncode != 0:
+                raise Exception('%s failed with exit code %d'
+                    % (' '.join(self.cmd), returncode))
+        return data
+
+    def read(self, size=-1):
+        if self.offset >= len(self.buffer) and not self.eof:
+            self.buffer = self._fill()
+            self.offset = 0
+        if size is None or size < 0:
+            parts = [self.buffer[self.offset:]]
+            self.buffer = ''
+            self.offset = 0
+            while not self.eof:
+                parts.append(self._fill())
+            return ''.join(parts)
+        result = self.buffer[self.offset:self.offset + size]
+        self.offset += len(result)
+        return result
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.eof:
+            # stopped reading early, svn is not needed any more
+            try:
+                os.kill(self.process.pid, 15)
+            except OSError:
+                pass
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class SpooledSvnLog(object):
+    """File-like object reading output of svn log process,
+    which is written to temporary file until it is needed.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.spool = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdout=self.spool)
+        self.finished = False
+
+    def read(self, size=-1):
+        if not self.finished:
+            returncode = self.process.wait()
+            if returncode != 0:
+                raise Exception('%s failed with exit code %d'
+                    % (' '.join(self.cmd), returncode))
+            self.spool.seek(0)
+            self.finished = True
+        return self.spool.read(size)
+
+    def close(self):
+        if not self.finished and self.process.poll() is None:
+            try:
+                os.kill(self.process.pid, 15)
+            except OSError:
+                pass
+            self.process.wait()
+        self.spool.close()
+
+
+def _log_body(stream):
+    """Yield blocks of svn xml log read from stream, without
+    xml declaration and <log> element around log entries.
+    """
+    tail_size = len(LOG_FOOTER) + 16
+    head = ''
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            raise Exception('no <log> element in svn output')
+        head += data
+        i = head.find('<log>')
+        if i >= 0:
+            carry = head[i + len('<log>'):]
+            break
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        carry += data
+        if len(carry) > tail_size:
+            yield carry[:-tail_size]
+            carry = carry[-tail_size:]
+    i = carry.rfind('</log>')
+    if i < 0:
+        raise Exception('no </log> at the end of svn output')
+    yield carry[:i]
+
+
+class MergedLogReader(object):
+    """File-like object returning logs read from sources, one after
+    another, as one xml log document.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.blocks = self._blocks()
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+
+    def _blocks(self):
+        yield LOG_HEADER
+        for source in self.sources:
+            for block in _log_body(source):
+                yield block
+            source.close()
+        yield LOG_FOOTER
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self.buffer[self.offset:]] + list(self.blocks)
+            self.buffer = ''
+            self.offset = 0
+            self.eof = True
+            return ''.join(parts)
+        while self.offset >= len(self.buffer) and not self.eof:
+            try:
+                self.buffer = self.blocks.next()
+            except StopIteration:
+                self.buffer = ''
+                self.eof = True
+            self.offset = 0
+        result = self.buffer[self.offset:self.offset + size]
+        self.offset += len(result)
+        return result
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+
+def get_head_revision(repo_url, svn_binary='svn'):
+    """Return youngest revision of repository at repo_url."""
+    cmd = [svn_binary, 'info', '--xml', '--non-interactive', repo_url]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise Exception('%s failed with exit code %d'
+            % (' '.join(cmd), process.returncode))
+    doc = xml.dom.minidom.parseString(output)
+    return int(doc.getElementsByTagName('entry')[0].getAttribute('revision'))
+
+
+def split_revision_range(first, last, count):
+    """Split revisions first..last into at most count (first, last)
+    ranges of similar size.
+    """
+    size = max(1, (last - first + count) // count)
+    ranges = []
+    start = first
+    while start <= last:
+        end = min(last, start + size - 1)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def open_svn_log_ranges(repo_url, svn_binary='svn', first_revision=1, jobs=2):
+    """Fetch log of revisions from first_revision to HEAD, running jobs
+    svn log processes for consecutive revision ranges at the same time.
+
+    Return file-like object reading one xml log, oldest revision first.
+    First range is read straight from svn, the others are kept in
+    temporary files until their turn comes.
+    """
+    head = get_head_revision(repo_url, svn_binary)
+    ranges = split_revision_range(first_revision, head, jobs)
+    sources = []
+    for i, (first, last) in enumerate(ranges):
+        cmd = svn_log_command(svn_binary, repo_url, '%d:%d' % (first, last))
+        print "running %s" % ' '.join(cmd)
+        if i == 0:
+            sources.append(SvnLogReader(cmd))
+        else:
+            sources.append(SpooledSvnLog(cmd))
+    return MergedLogReader(sources)
+
+
+def open_svn_log(repo_url, svn_binary='svn', revision_range=None):
+    """Start svn log for repo_url, return file-like object reading
+    its xml output.
+    """
+    cmd = svn_log_command(svn_binary, repo_url, revision_range)
+    print "running %s" % ' '.join(cmd)
+    return SvnLogReader(cmd)
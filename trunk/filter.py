@@ -1,22 +1,69 @@
 #!/usr/bin/env python2.4
 
+"""Remove control characters from svn xml log.
+
+Can be used as a filter in a pipe, or imported to sanitize input
+in process with SanitizingReader.
+"""
+
 import sys
-import re
+import codecs
 
 
-def main():
+BLOCK_SIZE = 1024 * 1024
+
+# all characters below 32 except new line, which filter always kept
+# by reprinting lines
+_identity_table = ''.join([chr(i) for i in range(256)])
+_bad_chars = ''.join([chr(i) for i in range(32) if chr(i) != '\n'])
+
+
+def sanitize(data):
+    """Return utf-8 block data with control characters removed.
+
+    data must not end in the middle of a multibyte character.
+    """
+    data = unicode(data, 'utf-8', 'replace').encode('utf-8')
+    return data.translate(_identity_table, _bad_chars)
 
-    s = '['
-    for i in range(32):
-        s += chr(i)
-    s += ']+'
 
-    bad = re.compile(s)
+class SanitizingReader(object):
+    """File-like object returning data read from stream with control
+    characters removed and invalid utf-8 sequences replaced.
 
-    for line in sys.stdin:
-        print bad.sub('', unicode(line, 'utf-8', 'replace').encode('utf-8'))
+    Works on whole blocks: utf-8 is checked by incremental decoder and
+    characters are deleted with str.translate.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def read(self, size=-1):
+        # empty string means end of input, so keep reading until
+        # something is left after filtering
+        while True:
+            if size is None or size < 0:
+                data = self.stream.read()
+            else:
+                data = self.stream.read(size)
+            text = self.decoder.decode(data, not data)
+            result = text.encode('utf-8').translate(_identity_table, _bad_chars)
+            if result or not data:
+                return result
+
+    def close(self):
+        self.stream.close()
+
+
+def main():
+    reader = SanitizingReader(sys.stdin)
+    while True:
+        data = reader.read(BLOCK_SIZE)
+        if not data:
+            break
+        sys.stdout.write(data)
 
 
 if __name__ == '__main__':
     main()
-
@@ -5,18 +5,35 @@ import sys, os, time, re, os.path
 import optparse
 import xml.sax
 import xml.sax.handler
+import xml.etree.cElementTree as cElementTree
 import cgi
 import datetime
+import zlib
+import bz2
+import subprocess
+import shutil
+import itertools
+import collections
+import hashlib
 from cStringIO import StringIO
 from textwrap import dedent
 from ConfigParser import ConfigParser
 
 import config
 import db
-from reports import AllReports, Report, ReportGroup
-from common import parse_date, ensure_date
+import fetch
+from filter import SanitizingReader, sanitize
+from reports import AllReports, Report, ReportGroup, ReportCache, \
+    ReportPlanner, AggregateResults
+from common import parse_svn_date, ensure_date, datetime_to_epoch, \
+    epoch_to_datetime, epoch_day, calendar_types, iter_periods
 
 
+DEFAULT_BATCH_SIZE = 1000
+INPUT_CHUNK_SIZE = 1024 * 1024
+PARALLEL_CHUNK_SIZE = 1024 * 1024
+DEFAULT_PROGRESS_INTERVAL = 10.0
+
 class OnePageHTMLStatsGenerator(object):
     """Generate html stats and put then on one page,
     like previous versions of mpy-svn-stats did.
@@ -48,43 +65,34 @@ class OnePageHTMLStatsGenerator(object):
                         </ul>
                     </li>""")
 
-    def generate(self, options, reports, cursor):
-
-        time_generated_start = datetime.datetime.now()
-
-        s = StringIO()
-
-        s.write("""
-            <div class="header">
-                <h1>Statistics for <em>%s</em></h1>
-            </div>
-        """ % self.escape(options.repo_url))
-        self._write_menu(s, reports)
-        s.write('<div class="reports">\n')
-        for report in reports.get_all_reports():
-            assert isinstance(report, Report), Exception('%s is not a report' % repr(report))
-            try:
-                html = report.generate(
-                    cursor=cursor,
-                    options=options,
-                    format='html',
-                    with_links=True
-                )
-                s.write(html)
-            except (Exception, TypeError), e:
-                print report, "failed"
-                raise
-        s.write('</div>\n')
+    def generate(self, options, reports, cursor, cache=None, jobs=1):
+        """Write page with reports to index.xhtml in output directory.
 
+        Page is written while reports are generated, fragment by
+        fragment, so it is never kept in memory as a whole. It goes to
+        temporary file first, which replaces index.xhtml when all
+        reports are done - page written before is kept if report fails.
+        """
 
         filename = 'index.xhtml'
         output_dir = options.output_dir
 
-        output_file = file(os.path.join(output_dir, filename), 'w')
+        path = os.path.join(output_dir, filename)
+        temp_path = path + '.tmp'
+        output_file = file(temp_path, 'w')
+        try:
+            self._write_page(output_file, options, reports, cursor, cache, jobs)
+            output_file.close()
+        except:
+            output_file.close()
+            os.remove(temp_path)
+            raise
+        os.rename(temp_path, path)
 
-        time_generated_end = datetime.datetime.now()
+        return True
 
-        generated_in = time_generated_end - time_generated_start
+    def _write_page(self, output_file, options, reports, cursor, cache, jobs):
+        time_generated_start = datetime.datetime.now()
 
         title = "MPY-SVN-STATS for %s" % options.repo_url
 
@@ -98,11 +106,36 @@ class OnePageHTMLStatsGenerator(object):
                     <title>%(title)s</title>
                     <meta http-equiv="Content-Type" content="text/xhtml; charset=utf-8" />
                     <style type="text/css">
-                        %(css)s
+            """) % {
+            'title': title,
+        })
+        css_file = file('mpyss.css')
+        shutil.copyfileobj(css_file, output_file)
+        css_file.close()
+        output_file.write(dedent("""\
                     </style>
                 </head>
                 <body>
-                    %(body)s
+            """))
+
+        output_file.write("""
+            <div class="header">
+                <h1>Statistics for <em>%s</em></h1>
+            </div>
+        """ % self.escape(options.repo_url))
+        self._write_menu(output_file, reports)
+        output_file.write('<div class="reports">\n')
+        for fragments in self._generate_reports(options,
+                reports.get_all_reports(), cursor, cache, jobs):
+            for fragment in fragments:
+                output_file.write(fragment)
+        output_file.write('</div>\n')
+
+        time_generated_end = datetime.datetime.now()
+
+        generated_in = time_generated_end - time_generated_start
+
+        output_file.write(dedent("""\
                     <hr />
                     <p class="footer">
                         Generated by <a href="http://mpy-svn-stats.berlios.de/">mpy-svn-stats</a>
@@ -112,28 +145,149 @@ class OnePageHTMLStatsGenerator(object):
                 </body>
             </html>
         """) % {
-            'body': s.getvalue(),
-            'css': file('mpyss.css').read(),
             'time_generated': time_generated_end.strftime('%Y-%m-%d %H:%M:%S'),
             'seconds': generated_in.seconds,
-            'title': title,
         })
 
-        return True
+    def _generate_reports(self, options, reports, cursor, cache, jobs):
+        """Yield output of reports, in the same order, each one as
+        iterable of html fragments.
+
+        Reports not found in cache are generated by this process, as
+        they are written, or by pool of jobs processes if jobs > 1.
+        Aggregates reports share are computed by this process first,
+        each one once (see ReportPlanner), and passed to processes
+        generating reports.
+        """
+        fragments = [None] * len(reports)
+        todo = []
+        for i, report in enumerate(reports):
+            assert isinstance(report, Report), Exception('%s is not a report' % repr(report))
+            if cache is not None:
+                fragments[i] = cache.get(report, 'html', True)
+            if fragments[i] is None:
+                todo.append(i)
+        aggregates = ReportPlanner([reports[i] for i in todo]).compute(cursor)
+        print "computed %d aggregates for %d reports" % (aggregates.computed, len(todo))
+        pool = None
+        if jobs > 1 and len(todo) > 1:
+            import multiprocessing
+            print "generating %d reports in %d processes" % (len(todo), jobs)
+            pool = multiprocessing.Pool(min(jobs, len(todo)), init_report_worker)
+            # results come in order, as soon as they are ready
+            results = pool.imap(generate_report_in_worker,
+                [(reports[i], options,
+                        aggregates.get_results(reports[i].get_aggregates()))
+                    for i in todo], 1)
+        try:
+            for i, report in enumerate(reports):
+                if fragments[i] is not None:
+                    yield [fragments[i]]
+                    continue
+                if pool is not None:
+                    html = results.next()
+                    yield [html]
+                elif cache is not None:
+                    html = []
+                    for fragment in iter_report(report, options, cursor, aggregates):
+                        html.append(fragment)
+                        yield [fragment]
+                    html = ''.join(html)
+                else:
+                    yield iter_report(report, options, cursor, aggregates)
+                    continue
+                if cache is not None:
+                    cache.put(report, html, 'html', True)
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+# database connection of report generating process, see init_report_worker
+_worker_connection = None
+
+def init_report_worker():
+    """Open database connection for reports generated by this process."""
+    global _worker_connection
+    _worker_connection = db.connect()
+
+
+def iter_report(report, options, cursor, aggregates):
+    """Yield html fragments of report."""
+    try:
+        for fragment in report.generate_fragments(
+                cursor=cursor,
+                options=options,
+                format='html',
+                with_links=True,
+                aggregates=aggregates):
+            yield fragment
+    except (Exception, TypeError), e:
+        print report, "failed"
+        raise
+
+
+def generate_report(report, options, cursor, aggregates):
+    return ''.join(iter_report(report, options, cursor, aggregates))
+
+
+def generate_report_in_worker(args):
+    """Generate report in worker process of report generating pool.
+    results are results of aggregates computed by parent process.
+    """
+    report, options, results = args
+    cursor = _worker_connection.cursor()
+    return generate_report(report, options, cursor,
+        AggregateResults(cursor, results))
 
 
 def main(argv):
     options, args = parse_options()
     conn = db.connect()
-    db.create_db_if_needed(conn)
+    db.create_db_if_needed(conn,
+        with_indexes=not (options.parse and options.bulk_load))
+    if options.print_fetch_range:
+        print make_fetch_range(get_last_revision(conn, options.repo_url))
+        return
     if options.parse:
         print "parsing"
-        if options.input == '-':
-            print "reading from stdin"
-            input = sys.stdin
+        input_name = None
+        if options.fetch:
+            last_revision = None
+            if options.incremental:
+                last_revision = get_last_revision(conn, options.repo_url)
+            if options.fetch_jobs > 1:
+                input = fetch.open_svn_log_ranges(options.repo_url,
+                    options.svn_binary, (last_revision or 0) + 1,
+                    options.fetch_jobs)
+            else:
+                # oldest first, so interrupted import leaves no gap
+                # behind last imported revision; starting from it
+                # (which is skipped) works when there is nothing new
+                revision_range = '1:HEAD'
+                if last_revision is not None:
+                    revision_range = '%d:HEAD' % last_revision
+                input = fetch.open_svn_log(options.repo_url, options.svn_binary,
+                    revision_range)
         else:
-            input = file(options.input)
-        get_data(conn, input, options.repo_url)
+            if options.input == '-':
+                print "reading from stdin"
+                input_name = options.input
+            else:
+                input_name = os.path.abspath(options.input)
+            input = open_input(options.input)
+        get_data(conn, input, options.repo_url, batch_size=options.batch_size,
+            incremental=options.incremental, parser=options.parser,
+            jobs=options.jobs, sanitize_input=options.sanitize,
+            bulk_load=options.bulk_load,
+            progress_interval=options.progress_interval,
+            metrics_file=options.metrics_file,
+            input_name=input_name, resume=options.resume)
+        input.close()
     if options.reports:
         print "generating reports"
         generate_reports(options, conn)
@@ -147,18 +301,580 @@ def generate_reports(options, conn):
         os.makedirs(output_dir)
     reports = AllReports(options)
     cursor = conn.cursor()
+    cache = None
+    if options.report_cache:
+        cache = ReportCache(conn, options.repo_url)
     generator = OnePageHTMLStatsGenerator()
-    generator.generate(options, reports, cursor)
+    generator.generate(options, reports, cursor, cache, options.report_jobs)
+    if cache is not None:
+        print "%d reports from cache, %d generated" % (cache.hits, cache.misses)
+
+
+compression_magic = (
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bzip2'),
+    ('\xfd7zXZ\x00', 'xz'),
+)
+
+
+def detect_compression(head):
+    """Return compression name for data starting with head, or None."""
+    for magic, compression in compression_magic:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def make_decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'bzip2':
+        return bz2.BZ2Decompressor()
+    elif compression == 'xz':
+        import lzma
+        return lzma.LZMADecompressor()
+    else:
+        raise ValueError('unknown compression: %s' % repr(compression))
+
+
+class PeekedStream(object):
+    """File-like object returning head before the rest of stream."""
+
+    def __init__(self, stream, head):
+        self.stream = stream
+        self.head = head
+
+    def read(self, size=-1):
+        head, self.head = self.head, ''
+        if size is None or size < 0:
+            return head + self.stream.read()
+        if len(head) > size:
+            head, self.head = head[:size], head[size:]
+        return head or self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+
+
+class DecompressingReader(object):
+    """File-like object decompressing stream on the fly.
+
+    Compressed data is read in INPUT_CHUNK_SIZE blocks. Concatenated
+    compressed streams (like from cat a.gz b.gz) are read one after another.
+    """
+
+    def __init__(self, stream, compression, head=''):
+        self.stream = stream
+        self.compression = compression
+        self.decompressor = make_decompressor(compression)
+        self.pending = head
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+
+    def _fill(self):
+        while not self.eof:
+            data = self.pending or self.stream.read(INPUT_CHUNK_SIZE)
+            self.pending = ''
+            if not data:
+                self.eof = True
+                flush = getattr(self.decompressor, 'flush', None)
+                if flush:
+                    return flush()
+                return ''
+            try:
+                result = self.decompressor.decompress(data)
+            except EOFError:
+                # stream ended exactly at the end of data read before
+                # (bz2 and lzma do not keep data after end of stream
+                # in unused_data then), data starts the next one
+                self.decompressor = make_decompressor(self.compression)
+                result = self.decompressor.decompress(data)
+            if self.decompressor.unused_data:
+                self.pending = self.decompressor.unused_data
+                self.decompressor = make_decompressor(self.compression)
+            if result:
+                return result
+        return ''
+
+    def read(self, size=-1):
+        if self.offset >= len(self.buffer):
+            self.buffer = self._fill()
+            self.offset = 0
+        if size is None or size < 0:
+            parts = [self.buffer[self.offset:]]
+            self.buffer = ''
+            self.offset = 0
+            while not self.eof:
+                parts.append(self._fill())
+            return ''.join(parts)
+        result = self.buffer[self.offset:self.offset + size]
+        self.offset += len(result)
+        return result
+
+    def close(self):
+        self.stream.close()
+
+
+class CountingReader(object):
+    """File-like object adding number of bytes read from stream
+    to counter.bytes_read.
+    """
+
+    def __init__(self, stream, counter):
+        self.stream = stream
+        self.counter = counter
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.counter.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.stream.close()
+
+
+def is_plain_file(stream):
+    """Check if stream is regular file, which can be memory mapped."""
+    return isinstance(stream, file) and os.path.isfile(stream.name)
+
+
+def skip_input(stream, count):
+    """Skip first count bytes of stream, seeking if it is plain file."""
+    if is_plain_file(stream):
+        stream.seek(count)
+        return
+    while count > 0:
+        data = stream.read(min(count, INPUT_CHUNK_SIZE))
+        if not data:
+            break
+        count -= len(data)
+
+
+def open_input(filename):
+    """Open log input file, use - for standard input.
+
+    Compressed input (gzip, bzip2 or xz, detected by magic bytes)
+    is decompressed on the fly. Without lzma module xz files are
+    decompressed by xz program.
+    """
+    if filename == '-':
+        stream = sys.stdin
+    else:
+        stream = file(filename, 'rb')
+    head = stream.read(6)
+    compression = detect_compression(head)
+    if compression:
+        print "reading %s compressed input" % compression
+        try:
+            return DecompressingReader(stream, compression, head)
+        except ImportError:
+            if compression != 'xz' or stream is sys.stdin:
+                raise
+        stream.close()
+        process = subprocess.Popen(['xz', '-dc', filename],
+            stdout=subprocess.PIPE, bufsize=INPUT_CHUNK_SIZE)
+        return process.stdout
+    if stream is sys.stdin:
+        return PeekedStream(stream, head)
+    stream.seek(0)
+    return stream
+
+
+class LogEntry(object):
+    """One parsed log entry (revision).
+
+    epoch is date in seconds since epoch, computed from date if not given.
+    offset is position in input right after the entry, if parser knows it.
+    """
+
+    def __init__(self, number, author, date, msg, paths, epoch=None,
+            offset=None):
+        self.number = number
+        self.author = author
+        self.date = date
+        if epoch is None:
+            epoch = datetime_to_epoch(date)
+        self.epoch = epoch
+        self.msg = msg
+        self.paths = paths
+        self.offset = offset
+
+    def fingerprint(self):
+        """Return hash of entry contents, used to detect changed revisions."""
+        h = hashlib.sha1()
+        h.update(self.author.encode('utf-8'))
+        h.update('\0%s\0' % self.date.isoformat())
+        h.update(self.msg.encode('utf-8'))
+        for action, path in sorted(self.paths):
+            h.update('\0%s\0%s' % (action.encode('utf-8'), path.encode('utf-8')))
+        return h.hexdigest()
+
+
+class LogEntryWriter(object):
+    """Copy log entries to sql database in batches.
+
+    Entries are buffered and each batch is written with one bulk statement
+    per table, followed by one commit. Revisions already stored with the
+    same fingerprint are not written again.
+
+    If input_name is given, every commit also saves checkpoint: last
+    revision of the batch and input offset after which parsing can be
+    resumed (see get_checkpoint).
+
+    Days of written revisions get their author_day rollup rows computed
+    again in the same transaction, unless update_rollups is False - then
+    it is left for write_rollups call.
+    """
+
+    def __init__(self, dbconn, repo_url, batch_size=DEFAULT_BATCH_SIZE,
+            input_name=None, update_rollups=True):
+        self.dbconn = dbconn
+        self.repo_url = repo_url
+        self.batch_size = max(1, batch_size)
+        self.input_name = input_name
+        self.update_rollups = update_rollups
+        self.last_offset = None
+        self.days = set()
+        self.generation_updated = False
+        self.cursor = self.dbconn.cursor()
+        repositories = db.NameDictionary(dbconn, 'repository', 'rp_id', 'rp_url')
+        self.repo_id = repositories.get_id(repo_url)
+        repositories.write_new()
+        self.authors = db.NameDictionary(dbconn, 'author', 'au_id', 'au_name')
+        self.paths = db.PathDictionary(dbconn)
+        self.entries = []
+        self.written = 0
+        self.unchanged = 0
+
+    def add(self, entry):
+        self.entries.append(entry)
+        if entry.offset is not None:
+            self.last_offset = entry.offset
+        if len(self.entries) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.entries:
+            return
+        last_number = self.entries[-1].number
+        # the same revision may be seen twice in one batch - last one wins
+        entries_by_number = {}
+        for entry in self.entries:
+            entries_by_number[entry.number] = entry
+        entries = [entries_by_number.pop(e.number) for e in self.entries
+            if e.number in entries_by_number]
+        self.entries = []
+
+        stored = self.get_stored_revisions(entries)
+        fingerprints = {}
+        for entry in entries:
+            fingerprints[entry.number] = entry.fingerprint()
+        entries = [e for e in entries
+            if stored.get(e.number, (None, None))[0] != fingerprints[e.number]]
+        self.unchanged += len(fingerprints) - len(entries)
+        self.written += len(entries)
+        if entries:
+            if not self.generation_updated:
+                self.update_generation()
+            self.write(entries, fingerprints)
+            for e in entries:
+                self.days.add(epoch_day(e.epoch))
+                # changed revision may have moved to other day
+                old_epoch = stored.get(e.number, (None, None))[1]
+                if old_epoch is not None:
+                    self.days.add(epoch_day(old_epoch))
+            if self.update_rollups:
+                self.write_rollups()
+        if self.input_name is not None:
+            self.save_checkpoint(last_number, self.last_offset)
+        self.dbconn.commit()
+
+    def write(self, entries, fingerprints):
+        keys = [{'repo_id': self.repo_id, 'number': e.number} for e in entries]
+
+        self.cursor.executemany(
+            '''
+                delete from path_change where
+                    rp_id = $repo_id and rv_number = $number
+            ''', keys)
+
+        self.cursor.executemany(
+            '''
+                delete from revision where
+                    rp_id = $repo_id and rv_number = $number
+            ''', keys)
+
+        revisions = [{
+            'repo_id': self.repo_id,
+            'number': e.number,
+            'author_id': self.authors.get_id(e.author),
+            'comment': e.msg.encode('utf-8'),
+            'timestamp': e.date,
+            'epoch': e.epoch,
+            'fingerprint': fingerprints[e.number],
+        } for e in entries]
+        self.authors.write_new()
+
+        self.cursor.executemany(
+            '''
+                insert into revision (
+                    rp_id,
+                    rv_number,
+                    au_id,
+                    rv_timestamp,
+                    rv_epoch,
+                    rv_comment,
+                    rv_fingerprint)
+                values (
+                    $repo_id,
+                    $number,
+                    $author_id,
+                    $timestamp,
+                    $epoch,
+                    $comment,
+                    $fingerprint)
+            ''', revisions)
+
+        path_changes = [{
+            'repo_id': self.repo_id,
+            'number': e.number,
+            'action': action.encode('utf-8'),
+            'path_id': self.paths.get_id(path),
+        } for e in entries for action, path in e.paths]
+        self.paths.write_new()
+
+        self.cursor.executemany(
+            '''
+                insert into path_change (
+                    rp_id,
+                    rv_number,
+                    cp_action,
+                    pt_id)
+                values (
+                    $repo_id,
+                    $number,
+                    $action,
+                    $path_id)
+            ''', path_changes)
+
+    def save_checkpoint(self, revision, offset):
+        params = {
+            'repo_id': self.repo_id,
+            'input': self.input_name,
+            'revision': revision,
+            'offset': offset,
+            'timestamp': datetime.datetime.now(),
+        }
+        self.cursor.execute(
+            '''
+                delete from ingest_checkpoint where rp_id = $repo_id
+            ''', params)
+        self.cursor.execute(
+            '''
+                insert into ingest_checkpoint (
+                    rp_id,
+                    ck_input,
+                    ck_revision,
+                    ck_offset,
+                    ck_timestamp)
+                values (
+                    $repo_id,
+                    $input,
+                    $revision,
+                    $offset,
+                    $timestamp)
+            ''', params)
+
+    def update_generation(self):
+        """Mark repository as changed, for ReportCache."""
+        self.cursor.execute('''
+                update repository
+                set rp_generation = coalesce(rp_generation, 0) + 1
+                where rp_id = $repo_id
+            ''', {'repo_id': self.repo_id})
+        self.generation_updated = True
+
+    def write_rollups(self):
+        """Compute rollups of days touched since last call."""
+        db.update_author_days(self.dbconn, self.repo_id, self.days)
+        self.days = set()
+
+    def get_stored_revisions(self, entries):
+        """Return dictionary mapping numbers of stored revisions in range
+        spanned by entries to their (fingerprint, epoch).
+        """
+        numbers = [e.number for e in entries]
+        self.cursor.execute(
+            '''
+                select rv_number, rv_fingerprint, rv_epoch
+                from revision
+                where rp_id = $repo_id
+                and rv_number >= $min_number and rv_number <= $max_number
+            ''', {
+                'repo_id': self.repo_id,
+                'min_number': min(numbers),
+                'max_number': max(numbers),
+        })
+        return dict([(number, (fingerprint, epoch))
+            for number, fingerprint, epoch in self.cursor.fetchall()])
+
+    def close(self):
+        self.flush()
+        print "%d revisions written, %d unchanged" % (self.written, self.unchanged)
+
+
+class IngestProgress(object):
+    """Pass log entries to writer, measuring ingest speed.
+
+    Progress is printed every interval seconds (never if interval is 0).
+    bytes_read is updated by whoever reads input, ETA is computed if
+    input_size is known.
+    """
+
+    def __init__(self, writer, input_size=None, interval=DEFAULT_PROGRESS_INTERVAL):
+        self.writer = writer
+        self.input_size = input_size
+        self.interval = interval
+        self.bytes_read = 0
+        self.revisions = 0
+        self.paths = 0
+        self.number = None
+        self.start_time = time.time()
+        self.end_time = None
+        self.last_report_time = self.start_time
+
+    def add(self, entry):
+        self.revisions += 1
+        self.paths += len(entry.paths)
+        self.number = entry.number
+        self.writer.add(entry)
+        if self.interval:
+            now = time.time()
+            if now - self.last_report_time >= self.interval:
+                self.last_report_time = now
+                self.report()
+
+    def close(self):
+        self.writer.close()
+        self.end_time = time.time()
+        self.report()
+
+    def get_metrics(self):
+        """Return dictionary of ingest metrics."""
+        seconds = (self.end_time or time.time()) - self.start_time
+        if seconds <= 0:
+            seconds = 1e-6
+        metrics = {
+            'revisions': self.revisions,
+            'paths': self.paths,
+            'bytes_read': self.bytes_read,
+            'input_size': self.input_size,
+            'last_revision': self.number,
+            'seconds': seconds,
+            'revisions_per_second': self.revisions / seconds,
+            'paths_per_second': self.paths / seconds,
+            'bytes_per_second': self.bytes_read / seconds,
+            'done': None,
+            'eta_seconds': None,
+        }
+        if self.input_size and self.bytes_read:
+            done = min(1.0, float(self.bytes_read) / self.input_size)
+            metrics['done'] = done
+            metrics['eta_seconds'] = seconds * (1.0 - done) / done
+        return metrics
+
+    def report(self):
+        m = self.get_metrics()
+        s = "progress: r%s, %d revisions (%.1f/s), %d paths (%.1f/s), %.1f MB (%.2f MB/s)" % (
+            m['last_revision'],
+            m['revisions'], m['revisions_per_second'],
+            m['paths'], m['paths_per_second'],
+            m['bytes_read'] / 1048576.0, m['bytes_per_second'] / 1048576.0)
+        if m['done'] is not None and self.end_time is None:
+            s += ", %.1f%%, eta %s" % (m['done'] * 100.0,
+                datetime.timedelta(seconds=int(m['eta_seconds'])))
+        print s
+
+
+def write_metrics(filename, metrics):
+    """Write metrics dictionary to file readable by ConfigParser."""
+    cp = ConfigParser()
+    cp.add_section('ingest')
+    for key, value in sorted(metrics.items()):
+        if value is not None:
+            cp.set('ingest', key, str(value))
+    f = file(filename, 'w')
+    try:
+        cp.write(f)
+    finally:
+        f.close()
+
+
+class StopParsing(Exception):
+    """Raised when the rest of the log is known to be already imported."""
+
+
+class NewRevisionsFilter(object):
+    """Pass to writer only revisions newer than last_revision.
+
+    Log may be ordered either way. Once entries are known to come
+    newest first, the first already imported entry ends parsing by
+    raising StopParsing.
+    """
+
+    def __init__(self, writer, last_revision):
+        self.writer = writer
+        self.last_revision = last_revision
+        self.previous_number = None
+        self.skipped = 0
+
+    def add(self, entry):
+        previous_number, self.previous_number = self.previous_number, entry.number
+        if entry.number > self.last_revision:
+            self.writer.add(entry)
+            return
+        self.skipped += 1
+        if previous_number is not None and previous_number > entry.number:
+            raise StopParsing()
+
+    def close(self):
+        print "skipped %d already imported revisions" % self.skipped
+        self.writer.close()
+
+
+class ResumeFilter(object):
+    """Skip log entries up to and including revision, which was
+    the last one committed before import was interrupted.
+    """
+
+    def __init__(self, writer, revision):
+        self.writer = writer
+        self.revision = revision
+        self.skipping = True
+        self.skipped = 0
+
+    def add(self, entry):
+        if not self.skipping:
+            self.writer.add(entry)
+            return
+        self.skipped += 1
+        if entry.number == self.revision:
+            self.skipping = False
+
+    def close(self):
+        print "skipped %d revisions imported before interruption" % self.skipped
+        if self.skipping:
+            print "warning: revision %d not found in input" % self.revision
+        self.writer.close()
 
 
 class SAXLogParserHandler(xml.sax.handler.ContentHandler):
     """Parser used to copy data from xml log to sql database."""
 
-    def __init__(self, dbconn, repo_url):
+    def __init__(self, writer):
         xml.sax.handler.ContentHandler.__init__(self)
-        self.repo_url = repo_url
-        self.dbconn = dbconn
-        self.cursor = self.dbconn.cursor()
+        self.writer = writer
         self.paths = None
 
     def startDocument(self):
@@ -197,72 +913,207 @@ class SAXLogParserHandler(xml.sax.handler.ContentHandler):
         self.current_characters = u''
 
     def add_current_logentry(self):
-        number = int(self.number)
-        msg = self.msg
-        date = parse_date(self.date)
         author = self.author
+        if author is None: author = u''
+        date, epoch = parse_svn_date(self.date)
+        self.writer.add(LogEntry(
+            number=int(self.number),
+            author=author,
+            date=date,
+            epoch=epoch,
+            msg=self.msg,
+            paths=self.paths))
 
-        if author is None: author = ''
 
-        self.cursor.execute(
-            '''
-                delete from changed_path where
-                    rv_repo_url = $url and rv_number = $number
-            ''', {
-                'url': self.repo_url,
-                'number': number,
-        })
+class ExpatLogParser(object):
+    """Streaming log parser using expat through cElementTree.
 
-        self.cursor.execute(
-            '''
-                delete from revision where
-                    rv_repo_url = $url and rv_number = $number
-            ''', {
-                    'url': self.repo_url,
-                    'number': number
-        })
+    Input is read in fixed size chunks, and all log entries complete
+    in a chunk are parsed by one cElementTree call, so python code runs
+    once for every entry rather than for every element and piece of
+    text (whitespace included), and memory use does not depend on log
+    size. Entries are found with string search: "<logentry" and
+    "</logentry>" can only be tags in svn xml log, text has "<" escaped.
+    Entries get offsets in input, counted from offset (unless it is None).
+    """
 
-        self.cursor.execute(
-            '''
-                insert into revision (
-                    rv_repo_url,
-                    rv_number,
-                    rv_author,
-                    rv_timestamp,
-                    rv_comment)
-                values (
-                    $url,
-                    $number,
-                    $author,
-                    $timestamp,
-                    $comment)
-            ''', {
-                'url': self.repo_url,
-                'number': int(number),
-                'author': author.encode('utf-8'),
-                'comment': msg.encode('utf-8'),
-                'timestamp': date
-        })
+    start_tag = '<logentry'
+    end_tag = '</logentry>'
 
-        for action, path in self.paths:
-            self.cursor.execute(
-            '''
-                insert into changed_path (
-                    rv_repo_url,
-                    rv_number,
-                    cp_action,
-                    cp_path)
-                values (
-                    $url,
-                    $number,
-                    $action,
-                    $path)
-            ''',{
-                'url': self.repo_url,
-                'number': int(self.number),
-                'action': action.encode('utf-8'),
-                'path': path.encode('utf-8'),
-            })
+    def __init__(self, writer, offset=0):
+        self.writer = writer
+        self.offset = offset
+
+    def parse(self, input_stream):
+        start_tag = self.start_tag
+        end_tag = self.end_tag
+        add = self.writer.add
+        # offset of buffer in input
+        position = self.offset or 0
+        buffer = ''
+        while True:
+            data = input_stream.read(INPUT_CHUNK_SIZE)
+            buffer += data
+            begin = buffer.find(start_tag)
+            end = buffer.rfind(end_tag)
+            if begin != -1 and end > begin:
+                end += len(end_tag)
+                try:
+                    entries = cElementTree.fromstring(
+                        '<log>' + buffer[begin:end] + '</log>')
+                except SyntaxError, e:
+                    # lines are counted from begin
+                    raise ValueError('%s, in log entries at offset %d'
+                        % (e, position + begin))
+                i = begin
+                for entry in entries:
+                    i = buffer.find(end_tag, i) + len(end_tag)
+                    offset = None
+                    if self.offset is not None:
+                        offset = position + i
+                    # cElementTree returns ascii text as str, which is
+                    # used like unicode
+                    date, epoch = parse_svn_date(entry.findtext('date'))
+                    paths = entry.find('paths')
+                    if paths is None:
+                        paths = ()
+                    add(LogEntry(
+                        number=int(entry.get('revision')),
+                        author=entry.findtext('author', u''),
+                        date=date,
+                        epoch=epoch,
+                        msg=entry.findtext('msg'),
+                        paths=[(path.get('action'), path.text or u'')
+                            for path in paths],
+                        offset=offset))
+                buffer = buffer[end:]
+                position += end
+            if not data:
+                break
+        if buffer.find(start_tag) != -1 or not buffer.rstrip().endswith('</log>'):
+            raise ValueError('log ends in the middle, near offset %d' % position)
+
+
+def parse_log_sax(input_stream, writer, offset=None):
+    # sax does not tell byte offsets, entries are added without them
+    xml.sax.parse(input_stream, SAXLogParserHandler(writer))
+
+
+def parse_log_expat(input_stream, writer, offset=0):
+    ExpatLogParser(writer, offset).parse(input_stream)
+
+
+log_parsers = {
+    'sax': parse_log_sax,
+    'expat': parse_log_expat,
+}
+
+
+class LogEntryBuffer(object):
+    """Collect parsed log entries in memory."""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, entry):
+        self.entries.append(entry)
+
+
+def split_log(data, chunk_count, offset=0):
+    """Split log held in data (string or mmap) into (start, end) offset pairs.
+
+    Every chunk starts at "<logentry" and contains whole log entries only.
+    Data before offset is left out.
+    """
+    first = data.find('<logentry', offset)
+    if first == -1:
+        return []
+    last = data.rfind('</log>')
+    if last == -1:
+        last = len(data)
+    step = max(1, (last - first) // chunk_count)
+    chunks = []
+    start = first
+    while start < last:
+        end = data.find('<logentry', min(start + step, last))
+        if end == -1 or end > last:
+            end = last
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def parse_log_chunk(args):
+    """Parse one chunk of log file, used by worker processes."""
+    import mmap
+    filename, start, end, parser, sanitize_input = args
+    f = file(filename, 'rb')
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        chunk = '<log>' + data[start:end] + '</log>'
+        data.close()
+    finally:
+        f.close()
+    offset = start - len('<log>')
+    if sanitize_input:
+        chunk = sanitize(chunk)
+        offset = None
+    buffer = LogEntryBuffer()
+    try:
+        log_parsers[parser](StringIO(chunk), buffer, offset)
+    except xml.sax.SAXParseException, e:
+        # sax exceptions can not be sent back to parent process
+        raise ValueError('%s in chunk at offset %d' % (e, start))
+    if buffer.entries:
+        # chunks end at entry boundaries, whichever parser is used
+        buffer.entries[-1].offset = end
+    return buffer.entries
+
+
+def parse_log_parallel(input_stream, writer, parser='sax', jobs=2,
+        sanitize_input=False, progress=None, offset=0):
+    """Parse log file in a pool of jobs processes.
+
+    Input file is memory mapped and split at log entry boundaries.
+    Parsed entries are handed to writer in input order by this process,
+    which stays the only one using the database connection. At most
+    2 * jobs chunks are parsed or wait for writer at a time, so entries
+    of whole log are not kept in memory when writer is slower than
+    parsers. If progress is given, its bytes_read is updated after each chunk.
+    Log entries before offset are not parsed.
+    """
+    import mmap
+    import multiprocessing
+    data = mmap.mmap(input_stream.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        chunk_count = max(jobs, (len(data) - offset) // PARALLEL_CHUNK_SIZE)
+        chunks = split_log(data, chunk_count, offset)
+    finally:
+        data.close()
+    print "parsing %d chunks in %d processes" % (len(chunks), jobs)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = collections.deque()
+        def submit(chunks):
+            for start, end in chunks:
+                pending.append((end, pool.apply_async(parse_log_chunk,
+                    ((input_stream.name, start, end, parser, sanitize_input),))))
+        chunks = iter(chunks)
+        submit(itertools.islice(chunks, 2 * jobs))
+        while pending:
+            end, result = pending.popleft()
+            entries = result.get()
+            # next chunk is parsed while entries are written
+            submit(itertools.islice(chunks, 1))
+            for entry in entries:
+                writer.add(entry)
+            if progress is not None:
+                progress.bytes_read = end
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
 
 
 def parse_options():
@@ -279,10 +1130,55 @@ def parse_options():
     parser.add_option("-i", "--input", dest="input",
         help="Input source file name (use - for standard input)",
         default=None)
+    parser.add_option('-f', '--fetch', action='store_true', dest='fetch',
+        default=False,
+        help='Fetch log from repository with svn client and parse it')
+    parser.add_option('--svn-binary', dest='svn_binary', default=config.svn_binary,
+        help='svn client program used by --fetch (default: %default)')
+    parser.add_option('--fetch-jobs', dest='fetch_jobs', type='int', default=1,
+        help='Number of svn log processes fetching revision ranges '
+            'at the same time (default: %default)')
+    parser.add_option('-b', '--batch-size', dest='batch_size', type='int',
+        default=DEFAULT_BATCH_SIZE,
+        help='Number of log entries written in one transaction (default: %default)')
+    parser.add_option('--parser', dest='parser', type='choice',
+        choices=sorted(log_parsers.keys()), default='sax',
+        help='Log parser backend (default: %default, possible values: expat, sax)')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+        help='Number of processes parsing input file (default: %default)')
+    parser.add_option('--sanitize', action='store_true', dest='sanitize',
+        default=False,
+        help='Remove control characters from input while parsing, like filter.py')
+    parser.add_option('--bulk-load', action='store_true', dest='bulk_load',
+        default=False,
+        help='Fast first import: create indexes after loading data, '
+            'do not use journal (database is lost if import is interrupted); '
+            'ignored if database already has revisions')
+    parser.add_option('--progress-interval', dest='progress_interval',
+        type='float', default=DEFAULT_PROGRESS_INTERVAL,
+        help='Seconds between import progress reports, 0 turns them off (default: %default)')
+    parser.add_option('--metrics-file', dest='metrics_file', default=None,
+        help='Write import metrics to this file when done')
+    parser.add_option('--incremental', action='store_true', dest='incremental',
+        default=False,
+        help='Import only revisions newer than those already in database')
+    parser.add_option('--resume', action='store_true', dest='resume',
+        default=False,
+        help='Continue interrupted import of the same input from its '
+            'last checkpoint (saved after every batch)')
+    parser.add_option('--print-fetch-range', action='store_true',
+        dest='print_fetch_range', default=False,
+        help='Print svn log -r option fetching revisions not yet in database '
+            '(from the last one imported, which --incremental skips) and exit')
     parser.add_option('-o', '--output-dir', dest='output_dir', default='mpy-svn-stats',
         help='Output directory (default: %default)')
     parser.add_option('-s', '--output-formats', dest='output_formats', default='html',
         help='Output formats, comma separated list  (default: %default, possible values: html)')
+    parser.add_option('--report-jobs', dest='report_jobs', type='int', default=1,
+        help='Number of processes generating reports (default: %default)')
+    parser.add_option('--no-report-cache', action='store_false', dest='report_cache',
+        default=True,
+        help='Generate all reports, do not use reports cached in database')
 
     def handle_config_option(option, opt_str, filename, parser):
         print "loading config file \"%s\"" % filename
@@ -302,6 +1198,8 @@ def parse_options():
         input = cp.get(s, 'input', None)
         if input:
             parser.values.input = input
+        if cp.has_option(s, 'svn_binary'):
+            parser.values.svn_binary = cp.get(s, 'svn_binary')
         output_dir = cp.get(s, 'output_dir', None)
         if output_dir: parser.values.output_dir = output_dir
             
@@ -314,66 +1212,260 @@ def parse_options():
 
     if not options.repo_url: parser.error('Please specify repository url with -u.')
 
+    if options.fetch:
+        if options.input:
+            parser.error('Use either --fetch or --input, not both.')
+        options.parse = True
     if options.input and not options.parse:
         print "warning: input defined, but parse is not set - not parsing!"
-    if options.parse and not options.input:
+    if options.parse and not options.input and not options.fetch:
         options.input = '-'
+    if options.jobs > 1 and options.input == '-':
+        parser.error('Parallel parsing (-j) needs input file, not standard input.')
+    if options.resume and options.fetch:
+        parser.error('--resume works with input files, use --incremental with --fetch.')
     
     return (options, args)
 
 
 def create_dates(dbconn):
-    """Create dates table for use in joins."""
+    """Extend calendar table, used in joins, to cover dates of all
+    revisions with day, week, month, quarter and year periods.
+
+    Only periods not yet in calendar are generated, each calendar type
+    is inserted with one bulk statement.
+    """
     curs = dbconn.cursor()
-    if not dbconn.table_exists('calendar'):
-        raise Exception()
+    db.create_calendar_if_needed(dbconn)
     print "creating dates..."
-    sql = 'select min(rv_timestamp), max(rv_timestamp) from revision'
-    curs.execute(sql)
-    min_date, max_date = map(ensure_date, curs.fetchone())
+    curs.execute('select min(rv_epoch), max(rv_epoch) from revision')
+    min_epoch, max_epoch = curs.fetchone()
+    if min_epoch is None:
+        return
+    min_date = epoch_to_datetime(min_epoch)
+    max_date = epoch_to_datetime(max_epoch)
     print "min date: %s" % repr(min_date)
     print "max date: %s" % repr(max_date)
-    min_year = min_date.year
-    max_year = max_date.year
-    for year in xrange(min_year, max_year+1):
-        for month in range(1, 13):
-            d = datetime.datetime(year, month, 1)
-            curs.execute('''
-                    select count(*)
-                    from calendar
-                    where timestamp = $timestamp
-                    and calendar_type = 'month'
-                ''',
-                {'timestamp': d})
-            cnt = curs.fetchone()[0]
-            if cnt == 0:
-                curs.execute(
-                    '''insert into calendar (
-                        timestamp, calendar_type,
-                        year, month, day,
-                        hour, minute, second
-                    ) values (
-                        $timestamp, $calendar_type,
-                        $year, $month, $day,
-                        $hour, $minute, $second
-                    )
-                    ''',
-                    {'timestamp': d,
-                        'calendar_type': 'month',
-                        'year': d.year,
-                        'month': d.month,
-                        'day': d.day,
-                        'hour': d.hour,
-                        'minute': d.minute,
-                        'second': d.second
-                    })
-
-
-def get_data(dbconn, input_stream, repo_url):
-    handler = SAXLogParserHandler(dbconn, repo_url)
-    parser = xml.sax.parse(input_stream, handler)
+    for calendar_type in calendar_types:
+        curs.execute('''
+                select min(timestamp), max(timestamp)
+                from calendar
+                where calendar_type = $calendar_type
+            ''', {'calendar_type': calendar_type})
+        first, last = map(ensure_date, curs.fetchone())
+        # calendar has no gaps, so only periods before first
+        # and after last are missing
+        rows = [{
+            'calendar_type': calendar_type,
+            'timestamp': start,
+            'end_timestamp': end,
+            'year': start.year,
+            'month': start.month,
+            'day': start.day,
+            'hour': 0,
+            'minute': 0,
+            'second': 0,
+        } for start, end in iter_periods(calendar_type, min_date, max_date)
+            if first is None or start < first or start > last]
+        if not rows:
+            continue
+        print "adding %d %s periods" % (len(rows), calendar_type)
+        curs.executemany(
+            '''insert into calendar (
+                timestamp, end_timestamp, calendar_type,
+                year, month, day,
+                hour, minute, second
+            ) values (
+                $timestamp, $end_timestamp, $calendar_type,
+                $year, $month, $day,
+                $hour, $minute, $second
+            )
+            ''', rows)
+
+
+def get_last_revision(dbconn, repo_url):
+    """Return biggest revision number imported for repo_url, or None."""
+    curs = dbconn.cursor()
+    curs.execute('''
+            select max(rv.rv_number)
+            from revision rv
+            join repository rp on rp.rp_id = rv.rp_id
+            where rp.rp_url = $url
+        ''', {'url': repo_url})
+    return curs.fetchone()[0]
+
+
+def has_revisions(dbconn):
+    """Return True if any revisions (of any repository) are imported."""
+    curs = dbconn.cursor()
+    curs.execute('select 1 from revision limit 1')
+    return curs.fetchone() is not None
+
+
+def set_bulk_load_pending(dbconn, repo_id, pending):
+    """Mark bulk load of repository as started or finished."""
+    curs = dbconn.cursor()
+    curs.execute('''
+            update repository set rp_bulk_load = $pending
+            where rp_id = $repo_id
+        ''', {'repo_id': repo_id, 'pending': int(pending)})
+
+
+def is_bulk_load_pending(dbconn, repo_id):
+    """Return True if bulk load of repository was started and not
+    finished - its indexes, rollups or statistics may be missing.
+    """
+    curs = dbconn.cursor()
+    curs.execute('select rp_bulk_load from repository where rp_id = $repo_id',
+        {'repo_id': repo_id})
+    row = curs.fetchone()
+    return bool(row and row[0])
+
+
+def get_checkpoint(dbconn, repo_url, input_name):
+    """Return (revision, offset) checkpoint saved by interrupted import
+    of input_name into repo_url, or None.
+    """
+    curs = dbconn.cursor()
+    curs.execute('''
+            select ck.ck_input, ck.ck_revision, ck.ck_offset
+            from ingest_checkpoint ck
+            join repository rp on rp.rp_id = ck.rp_id
+            where rp.rp_url = $url
+        ''', {'url': repo_url})
+    row = curs.fetchone()
+    if row is None:
+        return None
+    checkpoint_input, revision, offset = row
+    if checkpoint_input != input_name:
+        print "warning: checkpoint is from import of %s, not resuming" % checkpoint_input
+        return None
+    return revision, offset
+
+
+def clear_checkpoint(dbconn, repo_url):
+    """Forget checkpoint of repo_url, import finished."""
+    curs = dbconn.cursor()
+    curs.execute('''
+            delete from ingest_checkpoint
+            where rp_id in (
+                select rp_id from repository where rp_url = $url
+            )
+        ''', {'url': repo_url})
+
+
+def make_fetch_range(last_revision):
+    """Return svn log option selecting revisions after last_revision.
+
+    Range starts at last_revision itself, since last_revision + 1 does
+    not exist when there are no new commits; --incremental import
+    skips it.
+    """
+    if last_revision is None:
+        return '-r 1:HEAD'
+    return '-r %d:HEAD' % last_revision
+
+
+def get_data(dbconn, input_stream, repo_url, batch_size=DEFAULT_BATCH_SIZE,
+        incremental=False, parser='sax', jobs=1, sanitize_input=False,
+        bulk_load=False, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+        metrics_file=None, input_name=None, resume=False):
+    """Import log read from input_stream.
+
+    If input_name is given, checkpoints are saved while importing, and
+    with resume import continues from checkpoint left by earlier
+    interrupted import of the same input.
+
+    Bulk load is marked in database until indexes, rollups and
+    statistics are done after loading, so whatever import comes after
+    interrupted bulk load finishes them.
+    """
+    if bulk_load and has_revisions(dbconn):
+        # without journal, interrupted import would corrupt data
+        # imported before
+        print "warning: database is not empty, --bulk-load is for first imports, ignoring it"
+        bulk_load = False
+    # without indexes rollups are computed once, after loading
+    writer = entry_writer = LogEntryWriter(dbconn, repo_url, batch_size,
+        input_name, update_rollups=not bulk_load)
+    if bulk_load:
+        set_bulk_load_pending(dbconn, entry_writer.repo_id, True)
+        dbconn.commit()
+        dbconn.begin_bulk_load()
+    else:
+        # left out by create_db_if_needed or interrupted bulk load
+        db.create_indexes(dbconn)
+    if incremental:
+        last_revision = get_last_revision(dbconn, repo_url)
+        print "last imported revision: %s" % last_revision
+        if last_revision is not None:
+            writer = NewRevisionsFilter(writer, last_revision)
+    offset = 0
+    if resume and input_name is not None:
+        checkpoint = get_checkpoint(dbconn, repo_url, input_name)
+        if checkpoint is None:
+            print "no checkpoint to resume from, importing whole input"
+        else:
+            revision, offset = checkpoint
+            print "resuming after revision %d" % revision
+            if offset is None:
+                # parser did not know offsets, skip entries instead
+                offset = 0
+                writer = ResumeFilter(writer, revision)
+    if jobs > 1 and not is_plain_file(input_stream):
+        print "parallel parsing needs plain input file, parsing in one process"
+        jobs = 1
+    progress = None
+    if progress_interval or metrics_file:
+        input_size = None
+        if is_plain_file(input_stream):
+            input_size = os.fstat(input_stream.fileno()).st_size
+        writer = progress = IngestProgress(writer, input_size, progress_interval)
+        progress.bytes_read = offset
+    try:
+        if jobs > 1:
+            parse_log_parallel(input_stream, writer, parser, jobs,
+                sanitize_input, progress, offset)
+        else:
+            parser_offset = 0
+            if offset:
+                skip_input(input_stream, offset)
+            if progress is not None:
+                input_stream = CountingReader(input_stream, progress)
+            if offset:
+                # rest of input is parsed as log of its own
+                input_stream = PeekedStream(input_stream, fetch.LOG_HEADER)
+                parser_offset = offset - len(fetch.LOG_HEADER)
+            if sanitize_input:
+                # offsets in sanitized data are not offsets in input
+                input_stream = SanitizingReader(input_stream)
+                parser_offset = None
+            log_parsers[parser](input_stream, writer, parser_offset)
+    except StopParsing:
+        print "reached already imported revisions, stopping"
+    writer.close()
+    if input_name is not None:
+        clear_checkpoint(dbconn, repo_url)
     create_dates(dbconn)
     dbconn.commit()
+    if bulk_load or is_bulk_load_pending(dbconn, entry_writer.repo_id):
+        db.create_indexes(dbconn)
+        print "computing rollups"
+        db.rebuild_author_days(dbconn, entry_writer.repo_id)
+        dbconn.commit()
+        dbconn.end_bulk_load()
+        set_bulk_load_pending(dbconn, entry_writer.repo_id, False)
+        dbconn.commit()
+    if metrics_file:
+        metrics = progress.get_metrics()
+        metrics.update({
+            'repo_url': repo_url,
+            'parser': parser,
+            'jobs': jobs,
+            'batch_size': batch_size,
+            'total_seconds': time.time() - progress.start_time,
+        })
+        write_metrics(metrics_file, metrics)
 
 
 if __name__ == '__main__':
@@ -1,30 +1,98 @@
 
+create table repository (
+    rp_id integer not null,
+    rp_url varchar(256) not null,
+    rp_generation integer default 0,
+    rp_bulk_load integer default 0,
+    primary key (rp_id)
+);
+
+create unique index repository_url_i on repository (rp_url);
+
+create table author (
+    au_id integer not null,
+    au_name varchar(128) not null,
+    primary key (au_id)
+);
+
+create unique index author_name_i on author (au_name);
+
 create table revision (
-    rv_repo_url varchar(256) not null,
+    rp_id integer not null,
     rv_number integer not null,
-    rv_author varchar(128),
+    au_id integer not null,
     rv_timestamp timestamp not null,
+    rv_epoch integer,
     rv_comment varchar(102400) not null,
-    primary key(rv_repo_url, rv_number)
+    rv_fingerprint varchar(40),
+    primary key (rp_id, rv_number),
+    foreign key (rp_id) references repository (rp_id),
+    foreign key (au_id) references author (au_id)
 );
 
-create index revision_url_author_i on revision (rv_repo_url, rv_author);
-create index revision_url_timestamp_i on revision (rv_repo_url, rv_number);
+create index revision_url_author_i on revision (rp_id, au_id);
+create index revision_url_timestamp_i on revision (rp_id, rv_epoch);
 
-create table changed_path (
-    rv_repo_url varchar(256) not null,
+create table path (
+    pt_id integer not null,
+    pt_parent_id integer,
+    pt_path varchar(4096) not null,
+    primary key (pt_id)
+);
+
+create unique index path_path_i on path (pt_path);
+create index path_parent_i on path (pt_parent_id);
+
+create table path_change (
+    rp_id integer not null,
     rv_number integer not null,
-    cp_path varchar(4096) not null,
+    pt_id integer not null,
     cp_action varchar(1) not null,
-    primary key (rv_repo_url, rv_number, cp_path),
-    foreign key (rv_repo_url, rv_number) references revision (rv_repo_url, rv_number)
+    primary key (rp_id, rv_number, pt_id),
+    foreign key (rp_id, rv_number) references revision (rp_id, rv_number),
+    foreign key (pt_id) references path (pt_id)
 );
 
-create index changed_path_url_i on changed_path (rv_repo_url);
+create index path_change_url_i on path_change (rp_id);
+
+create view changed_path as
+    select
+        rp.rp_url as rv_repo_url,
+        pc.rv_number as rv_number,
+        pt.pt_path as cp_path,
+        pc.cp_action as cp_action
+    from path_change pc
+    join repository rp on rp.rp_id = pc.rp_id
+    join path pt on pt.pt_id = pc.pt_id;
+
+create table author_day (
+    rp_id integer not null,
+    au_id integer not null,
+    ad_day integer not null,
+    ad_commits integer not null,
+    ad_paths integer not null,
+    ad_msg_length integer not null,
+    primary key (rp_id, au_id, ad_day),
+    foreign key (rp_id) references repository (rp_id),
+    foreign key (au_id) references author (au_id)
+);
+
+create index author_day_day_i on author_day (rp_id, ad_day);
+
+create table ingest_checkpoint (
+    rp_id integer not null,
+    ck_input varchar(4096) not null,
+    ck_revision integer not null,
+    ck_offset integer,
+    ck_timestamp timestamp not null,
+    primary key (rp_id),
+    foreign key (rp_id) references repository (rp_id)
+);
 
 create table calendar (
     calendar_type varchar(128) not null,
     timestamp timestamp not null,
+    end_timestamp timestamp not null,
     year integer not null,
     month integer not null,
     day integer not null,
@@ -34,4 +102,26 @@ create table calendar (
 );
 
 create index calendar_timestamp_i on calendar(timestamp);
-create index calendar_type_i on calendar(calendar_type);
+create unique index calendar_type_timestamp_i on calendar(calendar_type, timestamp);
+
+create table report_cache (
+    rp_id integer not null,
+    rc_name varchar(128) not null,
+    rc_key varchar(40) not null,
+    rc_content text not null,
+    rc_timestamp timestamp not null,
+    primary key (rp_id, rc_name),
+    foreign key (rp_id) references repository (rp_id)
+);
+
+create table schema_version (
+    sv_version integer not null,
+    sv_timestamp timestamp not null,
+    primary key (sv_version)
+);
+
+create table migration_progress (
+    mp_name varchar(128) not null,
+    mp_position varchar(256) not null,
+    primary key (mp_name)
+);
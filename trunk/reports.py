@@ -3,12 +3,16 @@
 from __future__ import division
 
 import datetime
+import time
 import cgi
+import hashlib
+import itertools
+import operator
 from cStringIO import StringIO
 
 import db
 import svg
-from common import parse_date, ensure_date
+from common import epoch_to_datetime, epoch_day, SECONDS_IN_DAY
 
 class Report(object):
 
@@ -21,6 +25,31 @@ class Report(object):
     def __str__(self):
         return '%s(name=%s, title=%s)' % (self.__class__.__name__, self.name, self.title)
 
+    def get_cache_params(self):
+        """Return description of everything report output depends on,
+        except database contents (see ReportCache).
+        """
+        return repr(sorted(vars(self).items()))
+
+    def get_aggregates(self):
+        """Return list of aggregates report needs (see ReportPlanner).
+
+        Report generates itself from their results, which are passed
+        to generate in AggregateResults.
+        """
+        return []
+
+    def generate(self, cursor, options, format='html', with_links=True,
+            aggregates=None):
+        """Return output of report."""
+        return ''.join(self.generate_fragments(cursor, options, format,
+            with_links, aggregates))
+
+    def generate_fragments(self, cursor, options, format='html',
+            with_links=True, aggregates=None):
+        """Yield output of report in fragments, as it is produced."""
+        raise NotImplementedError()
+
     def go_to_top_link(self, with_links):
         if with_links:
             return u"""
@@ -63,55 +92,179 @@ class ReportGroup(object):
         return reports
 
 
+class Aggregate(object):
+    """Query whose result reports need.
+
+    Aggregates with the same sql and params are the same aggregate,
+    so reports declaring them share one result.
+    """
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+
+    def __str__(self):
+        return 'Aggregate(%s, %s)' % (self.key()[0], self.params)
+
+    def key(self):
+        return (' '.join(self.sql.split()), tuple(sorted(self.params.items())))
+
+    def compute(self, cursor):
+        """Return (column names, rows) of query result."""
+        cursor.execute(self.sql, self.params)
+        return [col[0] for col in cursor.description], cursor.fetchall()
+
+    def stream(self, cursor):
+        """Return (column names, iterator over rows) of query result."""
+        cursor.execute(self.sql, self.params)
+        return [col[0] for col in cursor.description], iter(cursor)
+
+
+class AggregateResults(object):
+    """Results of aggregates, each computed once, when first needed.
+
+    results is dictionary of results computed before, by aggregate key.
+    """
+
+    def __init__(self, cursor, results=None):
+        self.cursor = cursor
+        self.results = results or {}
+        self.computed = 0
+
+    def get(self, aggregate):
+        key = aggregate.key()
+        if key not in self.results:
+            self.results[key] = aggregate.compute(self.cursor)
+            self.computed += 1
+        return self.results[key]
+
+    def get_rows(self, aggregate):
+        return self.get(aggregate)[1]
+
+    def stream(self, aggregate):
+        """Return (column names, iterable of rows) of aggregate.
+
+        Result not computed before is read from database while rows are
+        iterated, with cursor of its own, and not kept.
+        """
+        key = aggregate.key()
+        if key in self.results:
+            return self.results[key]
+        return aggregate.stream(self.cursor.conn.cursor())
+
+    def get_results(self, aggregates):
+        """Return dictionary of results of aggregates computed before,
+        for AggregateResults of another process. Aggregates not computed
+        yet are left out, to be computed by that process.
+        """
+        return dict((a.key(), self.results[a.key()]) for a in aggregates
+            if a.key() in self.results)
+
+
+class ReportPlanner(object):
+    """Compute aggregates reports share, before reports are generated.
+
+    Each aggregate is computed once, however many reports need it.
+    Aggregates only one report needs are left to the report, so it can
+    stream their rows (see AggregateResults.stream). Aggregates depending
+    on results of other aggregates are not known in advance; reports
+    compute them when generated, also through AggregateResults.
+    """
+
+    def __init__(self, reports):
+        self.reports = reports
+
+    def compute(self, cursor):
+        """Return AggregateResults with aggregates shared by reports."""
+        users = {}
+        aggregates = []
+        for report in self.reports:
+            for aggregate in report.get_aggregates():
+                key = aggregate.key()
+                if key not in users:
+                    users[key] = 0
+                    aggregates.append(aggregate)
+                users[key] += 1
+        results = AggregateResults(cursor)
+        for aggregate in aggregates:
+            if users[aggregate.key()] > 1:
+                results.get(aggregate)
+        return results
+
+
+def revision_summary(repo_url):
+    """Aggregate of first and last revision number, revision count,
+    and first and last revision time of repository.
+    """
+    return Aggregate('''
+        select
+            min(rv_number),
+            max(rv_number),
+            count(rv_number),
+            min(rv_epoch),
+            max(rv_epoch)
+        from revision rv
+        join repository rp on rp.rp_id = rv.rp_id
+        where rp.rp_url = $url
+    ''', {'url': repo_url})
+
+
+def iter_html_table(columns, rows):
+    """Yield html table of query result, row by row."""
+
+    yield '<table>\n<tr>\n%s</tr>\n' % ''.join(
+        ['<th>%s</th>\n' % cgi.escape(col) for col in columns])
+    for row in rows:
+        yield '<tr>\n%s</tr>\n' % ''.join(
+            ['\t<td>%s</td>\n' % cgi.escape(str(value)) for value in row])
+    yield '</table>\n'
+
+
 class SQLTableReport(Report):
     def __init__(self, name, title, sql, params):
         Report.__init__(self, name, title)
         self.sql = sql
         self.params = params
 
-    def generate(self, cursor, options, format='html', with_links=True):
-        cursor.execute(self.sql, self.params)
-        return self.format_result(format, cursor, with_links)
+    def get_cache_params(self):
+        return repr((self.title, self.sql, sorted(self.params.items())))
 
-    def format_result(self, format, cursor, with_links):
+    def get_aggregates(self):
+        return [Aggregate(self.sql, self.params)]
+
+    def generate_fragments(self, cursor, options, format='html',
+            with_links=True, aggregates=None):
+        if aggregates is None:
+            aggregates = AggregateResults(cursor)
+        columns, rows = aggregates.stream(Aggregate(self.sql, self.params))
+        return self.format_result(format, columns, rows, with_links)
+
+    def format_result(self, format, columns, rows, with_links):
         if format== 'html':
-            return self.format_result_html(cursor, with_links)
+            return self.format_result_html(columns, rows, with_links)
         else:
             raise ValueError("unknown format: %s" % repr(format))
 
     def escape_html(self, text):
         return cgi.escape(text)
 
-    def format_result_html(self, cursor, with_links):
-
-        s = StringIO()
-
-        s.write('<table>\n')
-        s.write('<tr>\n')
-        for col in cursor.description:
-            s.write('<th>%s</th>\n' % self.escape_html(col[0]))
-        s.write('</tr>\n')
-        for row in cursor.fetchall():
-            s.write('<tr>\n')
-            for value in row:
-                s.write('\t<td>%s</td>\n' % self.escape_html(str(value)))
-            s.write('</tr>\n')
-        s.write('</table>\n')
-    
-        return ('''
+    def format_result_html(self, columns, rows, with_links):
+        """Yield html of report, reading rows while table is written."""
+        yield '''
             <div class="report">
                 <a id="%(anchor_name)s"></a>
                 <h2>%(title)s</h2>
                 %(go_to_top_link)s
-                %(table)s
-            </div>
-        ''' % {
-            'stylesheet': self.html_stylesheet,
+                ''' % {
             'title': self.escape_html(self.title),
-            'table': s.getvalue(),
             'go_to_top_link': self.go_to_top_link(with_links),
             'anchor_name': self.name,
-        })
+        }
+        for fragment in iter_html_table(columns, rows):
+            yield fragment
+        yield '''
+            </div>
+        '''
 
 
 class GeneralStatsReport(Report):
@@ -119,30 +272,24 @@ class GeneralStatsReport(Report):
         Report.__init__(self, 'general', 'General Statistics')
         self.repo_url = repo_url
 
-    def generate(self, cursor, options, format='html', with_links=True):
+    def get_aggregates(self):
+        return [revision_summary(self.repo_url)]
+
+    def generate_fragments(self, cursor, options, format='html',
+            with_links=True, aggregates=None):
+        if aggregates is None:
+            aggregates = AggregateResults(cursor)
         if format == 'html':
-            return self.generate_html(cursor=cursor, with_links=with_links)
+            return [self.generate_html(aggregates, with_links=with_links)]
         else:
             raise ValueError('unsupported format: %s' % format)
 
-    def generate_html(self, cursor, with_links=True):
-        cursor.execute(
-            '''
-                select
-                    min(rv_number),
-                    max(rv_number),
-                    count(rv_number),
-                    min(rv_timestamp),
-                    max(rv_timestamp)
-                from revision where rv_repo_url = $url
-            ''',
-            {'url': self.repo_url})
-        
-        result = cursor.fetchall()[0]
-
-        (min_rv_num, max_rv_num, rv_count, min_tstamp, max_tstamp) = result
-        if isinstance(min_tstamp, basestring): min_tstamp = parse_date(min_tstamp, datetime.datetime)
-        if isinstance(max_tstamp, basestring): max_tstamp = parse_date(max_tstamp, datetime.datetime)
+    def generate_html(self, aggregates, with_links=True):
+        result = aggregates.get_rows(revision_summary(self.repo_url))[0]
+
+        (min_rv_num, max_rv_num, rv_count, min_epoch, max_epoch) = result
+        min_tstamp = epoch_to_datetime(min_epoch)
+        max_tstamp = epoch_to_datetime(max_epoch)
         age = max_tstamp - min_tstamp
 
         days = age.days
@@ -188,41 +335,346 @@ class GeneralStatsReport(Report):
         }
 
 
+# (window, number of days or None for whole history) of group by reports
+count_windows = [('all', None), ('month', 30), ('week', 7)]
+window_titles = {'all': 'Count', 'month': 'Last month', 'week': 'Last week'}
+
+
+def group_by_and_count_aggregate(repo_url, group_by, source, repo_id_column,
+        time_column, count='1', condition=None, now=None, windows=None,
+        limit=None, label_source=None, label_id_column=None,
+        label_column=None):
+    """Create standard "group by" aggregate: rows of group and sums of
+    count expression over rows of source in the group, for each of
+    count_windows, computed with conditional aggregation in one query.
+    Windows start at beginning of day, so counts can be taken from
+    author_day rollups.
+
+    If limit is given, only limit groups with most counts in the first
+    of windows are selected, so database does not return and sort all
+    groups. Groups with equal counts are taken in group_by order, which
+    may not be order of their labels.
+
+    If label_source is given, groups are shown as label_column of its
+    row with label_id_column equal to group, joined after grouping -
+    so rows can be grouped by integer id instead of name or path.
+
+    group_by, source (from clause), repo_id_column (rp_id column
+    of source), time_column (seconds since epoch), count, condition
+    and label parameters are trusted - they're pasted directly into
+    sql code.
+
+    """
+
+    if now is None:
+        now = int(time.time())
+    counts = []
+    sums = {}
+    params = {'repo_url': repo_url}
+    for window, days in count_windows:
+        if days is None:
+            sums[window] = 'sum(%s)' % count
+        else:
+            sums[window] = 'sum(case when %s >= $since_%s then %s else 0 end)' % (
+                time_column, window, count)
+            params['since_' + window] = epoch_day(now - days * SECONDS_IN_DAY)
+        counts.append('%s as count_%s' % (sums[window], window))
+
+    order = ''
+    if limit is not None:
+        order = '''
+            having %s
+            order by count_%s desc, %s
+            limit %d''' % (
+                ' or '.join(['%s <> 0' % sums[window] for window in windows]),
+                windows[0], group_by, limit)
+
+    sql = '''
+            select %(group_by)s as group_id,
+                %(counts)s
+            from %(source)s
+            join repository rp on rp.rp_id = %(repo_id_column)s
+            where rp.rp_url = $repo_url
+            %(condition)s
+            group by %(group_by)s%(order)s
+
+    ''' % {
+            'group_by': group_by,
+            'order': order,
+            'counts': ',\n                '.join(counts),
+            'source': source,
+            'repo_id_column': repo_id_column,
+            'condition': condition and 'and %s' % condition or '',
+    }
+
+    if label_source is not None:
+        sql = '''
+            select %(label_column)s,
+                %(counts)s
+            from (%(sql)s) c
+            join %(label_source)s on %(label_id_column)s = c.group_id
+
+        ''' % {
+            'label_column': label_column,
+            'counts': ',\n                '.join(['c.count_%s' % window
+                for window, days in count_windows]),
+            'sql': sql,
+            'label_source': label_source,
+            'label_id_column': label_id_column,
+        }
+
+    return Aggregate(sql, params)
+
+
+def select_windows(rows, windows, limit=None):
+    """Return rows of group by aggregate with counts of windows only,
+    ordered by count in the first of windows, without groups with no
+    counts in windows. Only limit first rows are returned, if limit
+    is given.
+    """
+    window_names = [window for window, days in count_windows]
+    indexes = [window_names.index(window) + 1 for window in windows]
+    rows = [[row[0]] + [row[i] for i in indexes] for row in rows]
+    rows = [row for row in rows if any(row[1:])]
+    rows.sort(key=lambda row: (-row[1], row[0]))
+    if limit is not None:
+        rows = rows[:limit]
+    return rows
+
+
+def window_columns(group_title, windows):
+    if len(windows) == 1:
+        return [group_title, 'Count']
+    else:
+        return [group_title] + [window_titles[window] for window in windows]
+
+
 class GroupByAndCountSQLReport(SQLTableReport):
     """Group by report.
-    Usually tabular representation of some simple aggregation is required.
+    Usually tabular representation of some simple aggregation is required:
+    sum of count expression over rows of source, in each group, for the
+    whole history, last month and last week.
 
-    XXX
+    Counts of all windows are computed by one query (see
+    group_by_and_count_aggregate), so reports of the same grouping
+    showing different windows share it - one report can show all windows,
+    or each window can have its own report. Rows are ordered by count
+    in the first window shown, groups with no counts in windows shown
+    are left out.
 
     """
-    
-    def __init__(self, name, title, group_by):
-        sql, params = self.__make_sql(group_by=group_by)
-        SQLTableReport.__init__(self, name, title, sql, params)
 
-    def __make_sql(self, group_by):
-        """Create standard "group by" sql code.
-        group_by parameter is trusted - it's pasted directly into sql code.
+    def __init__(self, name, title, repo_url, group_by, group_title,
+            source, repo_id_column, time_column, count='1', condition=None,
+            windows=('all', 'month', 'week'), limit=None, now=None,
+            label_source=None, label_id_column=None, label_column=None):
+        aggregate = group_by_and_count_aggregate(repo_url=repo_url,
+            group_by=group_by, source=source, repo_id_column=repo_id_column,
+            time_column=time_column, count=count, condition=condition,
+            now=now, windows=windows, limit=limit, label_source=label_source,
+            label_id_column=label_id_column, label_column=label_column)
+        SQLTableReport.__init__(self, name, title, aggregate.sql, aggregate.params)
+        self.group_title = group_title
+        self.windows = tuple(windows)
+        self.limit = limit
+
+    def get_cache_params(self):
+        return repr((SQLTableReport.get_cache_params(self), self.group_title,
+            self.windows, self.limit))
+
+    def generate_fragments(self, cursor, options, format='html',
+            with_links=True, aggregates=None):
+        if aggregates is None:
+            aggregates = AggregateResults(cursor)
+        rows = aggregates.stream(Aggregate(self.sql, self.params))[1]
+        return self.format_result(format,
+            window_columns(self.group_title, self.windows),
+            select_windows(rows, self.windows, self.limit), with_links)
+
+
+class ChangedDirectoriesReport(Report):
+    """Most changed directories at each depth of directory tree.
+
+    Changes of directory are changes of all paths in its subtree. They
+    are counted for each changed path by one query, and then added up
+    the path tree (pt_parent_id), deepest paths first, so every path is
+    visited once - whole tree is aggregated in time proportional to
+    total length of paths, without query for each directory.
+    """
 
+    def __init__(self, repo_url, windows=('all', 'month', 'week'), limit=10,
+            now=None):
+        Report.__init__(self, 'most_changed_directories',
+            'Most changed directories')
+        self.repo_url = repo_url
+        self.windows = tuple(windows)
+        self.limit = limit
+        if now is None:
+            now = int(time.time())
+        self.now = now
+
+    def get_cache_params(self):
+        # since_* parameters of windows, not now, so report is reused
+        # until windows move to another day
+        return repr((self.title, self.repo_url, self.windows, self.limit,
+            sorted(self._changes_aggregate().params.items())))
+
+    def _changes_aggregate(self):
+        return group_by_and_count_aggregate(repo_url=self.repo_url,
+            group_by='pc.pt_id',
+            source='''path_change pc
+                join revision rv
+                    on rv.rp_id = pc.rp_id and rv.rv_number = pc.rv_number''',
+            repo_id_column='pc.rp_id',
+            time_column='rv.rv_epoch',
+            now=self.now)
+
+    def _paths_aggregate(self):
+        return Aggregate('''
+            select pt_id, pt_parent_id, pt_path
+            from path
+        ''', {})
+
+    def get_aggregates(self):
+        return [self._changes_aggregate(), self._paths_aggregate()]
+
+    def get_directories(self, aggregates):
+        """Return dictionary of lists of (path, count in each of
+        count_windows) rows of changed directories, by depth.
         """
+        totals = {}
+        for row in aggregates.stream(self._changes_aggregate())[1]:
+            totals[row[0]] = list(row[1:])
+        paths_by_depth = {}
+        directory_ids = set()
+        for path_id, parent_id, path in aggregates.stream(self._paths_aggregate())[1]:
+            if parent_id is None:
+                depth = 0
+            else:
+                depth = path.count('/')
+                directory_ids.add(parent_id)
+            paths_by_depth.setdefault(depth, []).append((path_id, parent_id, path))
+        directories = {}
+        for depth in sorted(paths_by_depth.keys(), reverse=True):
+            for path_id, parent_id, path in paths_by_depth[depth]:
+                counts = totals.get(path_id)
+                if counts is None:
+                    continue
+                if path_id in directory_ids and depth > 0:
+                    directories.setdefault(depth, []).append([path] + counts)
+                if parent_id is not None:
+                    parent_counts = totals.get(parent_id)
+                    if parent_counts is None:
+                        totals[parent_id] = list(counts)
+                    else:
+                        for i, count in enumerate(counts):
+                            parent_counts[i] += count
+        return directories
+
+    def generate_fragments(self, cursor, options, format='html',
+            with_links=True, aggregates=None):
+        if aggregates is None:
+            aggregates = AggregateResults(cursor)
+        if format != 'html':
+            raise ValueError('unsupported format: %s' % format)
+        directories = self.get_directories(aggregates)
+        yield '''
+            <div class="report">
+                <a id="%(anchor_name)s"></a>
+                <h2>%(title)s</h2>
+                %(go_to_top_link)s
+                ''' % {
+            'title': cgi.escape(self.title),
+            'anchor_name': self.name,
+            'go_to_top_link': self.go_to_top_link(with_links),
+        }
+        for depth in sorted(directories.keys()):
+            yield '<h3>Depth %d</h3>\n' % depth
+            for fragment in iter_html_table(
+                    window_columns('Directory', self.windows),
+                    select_windows(directories[depth], self.windows, self.limit)):
+                yield fragment
+        yield '''
+            </div>
+        '''
 
-        sql = '''
-                select %(group_by)s, count(*) as Count
-                from revision
-                where rv_repo_url = $repo_url
-                and rv_timestamp >= $last_month
-                group by %(group_by)s
-                order by Count desc
 
-        ''' % {
-                'group_by': group_by,
-        }
+class ReportCache(object):
+    """Persistent cache of generated reports, kept in report_cache table.
+
+    Output of report is reused as long as report class, name, parameters
+    and output format are the same, and repository state did not change:
+    its biggest revision number and ingest generation, which every import
+    writing revisions increments.
+    """
+
+    # change when reports produce different output for the same data
+    version = 2
+
+    def __init__(self, conn, repo_url):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.cursor.execute('''
+            select rp.rp_id, rp.rp_generation, max(rv.rv_number)
+            from repository rp
+            left join revision rv on rv.rp_id = rp.rp_id
+            where rp.rp_url = $url
+            group by rp.rp_id, rp.rp_generation
+        ''', {'url': repo_url})
+        row = self.cursor.fetchone()
+        self.repo_id = None
+        self.state = None
+        if row is not None:
+            self.repo_id = row[0]
+            self.state = (row[1] or 0, row[2])
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, report, format, with_links):
+        key = repr((self.version, report.__class__.__name__, report.name,
+            report.get_cache_params(), format, with_links, self.state))
+        return hashlib.sha1(key).hexdigest()
+
+    def get(self, report, format='html', with_links=True):
+        """Return cached output of report, or None."""
+        if self.repo_id is None:
+            return None
+        self.cursor.execute('''
+            select rc_key, rc_content
+            from report_cache
+            where rp_id = $repo_id and rc_name = $name
+        ''', {'repo_id': self.repo_id, 'name': report.name})
+        row = self.cursor.fetchone()
+        if row is not None and row[0] == self.make_key(report, format, with_links):
+            self.hits += 1
+            return row[1].encode('utf-8')
+        self.misses += 1
+        return None
+
+    def put(self, report, content, format='html', with_links=True):
+        """Store output of report."""
+        if self.repo_id is None:
+            return
         params = {
-                'repo_url': self.options.repo_url,
-                'last_month': last_month,
+            'repo_id': self.repo_id,
+            'name': report.name,
+            'key': self.make_key(report, format, with_links),
+            'content': content,
+            'timestamp': datetime.datetime.now(),
         }
-
-        return sql, params
+        if isinstance(content, str):
+            params['content'] = content.decode('utf-8')
+        self.cursor.execute('''
+            delete from report_cache
+            where rp_id = $repo_id and rc_name = $name
+        ''', params)
+        self.cursor.execute('''
+            insert into report_cache (
+                rp_id, rc_name, rc_key, rc_content, rc_timestamp)
+            values (
+                $repo_id, $name, $key, $content, $timestamp)
+        ''', params)
+        self.conn.commit()
 
 
 class AllReports(ReportGroup):
@@ -238,46 +690,26 @@ class AllReports(ReportGroup):
         options = self.options
         self.add(GeneralStatsReport(options.repo_url))
         self.create_commits_reports()
+        self.create_number_of_changed_paths_reports()
 
     def create_commits_reports(self):
         group = ReportGroup(name='commits', title='Commits Statistics')
-        last_week = (datetime.datetime.now() - datetime.timedelta(7))
-        last_month =(datetime.datetime.now() - datetime.timedelta(30))
-        group.add(SQLTableReport('authors_by_commits', 'Authors by commits',
-            '''
-                select rv_author as Author, count(*) as Count
-                from revision
-                where rv_repo_url = $repo_url
-                group by rv_author
-                order by Count desc
-
-            ''', {'repo_url': self.options.repo_url}))
-        group.add(SQLTableReport('authors_by_commits_month', 'Authors by commits - last month',
-            '''
-                select rv_author as Author, count(*) as Count
-                from revision
-                where rv_repo_url = $repo_url
-                and rv_timestamp >= $last_month
-                group by rv_author
-                order by Count desc
-
-            ''', {
-                'repo_url': self.options.repo_url,
-                'last_month': last_month,
-            }))
-        group.add(SQLTableReport('authors_by_commits_week', 'Authors by commits - last week',
-            '''
-                select rv_author as Author, count(*) as Count
-                from revision
-                where rv_repo_url = $repo_url
-                and rv_timestamp >= $last_week
-                group by rv_author
-                order by Count desc
-
-            ''', {
-                'repo_url': self.options.repo_url,
-                'last_week': last_week,
-            }))
+        for name, title, window in [
+                ('authors_by_commits', 'Authors by commits', 'all'),
+                ('authors_by_commits_month', 'Authors by commits - last month', 'month'),
+                ('authors_by_commits_week', 'Authors by commits - last week', 'week')]:
+            group.add(GroupByAndCountSQLReport(name, title,
+                repo_url=self.options.repo_url,
+                group_by='ad.au_id',
+                group_title='Author',
+                source='author_day ad',
+                repo_id_column='ad.rp_id',
+                time_column='ad.ad_day',
+                count='ad.ad_commits',
+                windows=[window],
+                label_source='author au',
+                label_id_column='au.au_id',
+                label_column='au.au_name'))
         group.add(CommitsByAuthorsGraphReport(repo_url=self.options.repo_url))
         group.add(CommitsByAuthorsGraphReport(repo_url=self.options.repo_url, date_range='month'))
         group.add(CommitsByAuthorsGraphReport(repo_url=self.options.repo_url, date_range='week'))
@@ -285,12 +717,45 @@ class AllReports(ReportGroup):
 
     def create_number_of_changed_paths_reports(self):
         group = ReportGroup(name='changed_paths', title='Changed Paths Statistics')
+        group.add(GroupByAndCountSQLReport('most_changed_files', 'Most changed files',
+            repo_url=self.options.repo_url,
+            group_by='pc.pt_id',
+            group_title='File',
+            source='''path_change pc
+                join revision rv
+                    on rv.rp_id = pc.rp_id and rv.rv_number = pc.rv_number''',
+            repo_id_column='pc.rp_id',
+            time_column='rv.rv_epoch',
+            condition='''pc.pt_id not in (
+                select pt_parent_id from path where pt_parent_id is not null)''',
+            limit=20,
+            label_source='path pt',
+            label_id_column='pt.pt_id',
+            label_column='pt.pt_path'))
+        group.add(ChangedDirectoriesReport(self.options.repo_url))
+        group.add(GroupByAndCountSQLReport('changed_paths_by_authors',
+            'Changed paths by authors',
+            repo_url=self.options.repo_url,
+            group_by='ad.au_id',
+            group_title='Author',
+            source='author_day ad',
+            repo_id_column='ad.rp_id',
+            time_column='ad.ad_day',
+            count='ad.ad_paths',
+            label_source='author au',
+            label_id_column='au.au_id',
+            label_column='au.au_name'))
         self.add(group)
 
 
 class CommitsByAuthorsGraphReport(Report):
     """Graph number of commits committers made."""
 
+    # windows at least this long are counted from daily rollups, whose
+    # error (commits of a day are counted at its beginning) is small
+    # compared to them
+    min_rollup_span = 7 * SECONDS_IN_DAY
+
     def __init__(self, repo_url, date_range='all'):
         name = 'commits_by_authors_graph_%s' % date_range
         title = self.make_title(date_range)
@@ -309,23 +774,54 @@ class CommitsByAuthorsGraphReport(Report):
         else:
             raise Exception()
 
-    def _get_authors(self, repo_url, cursor):
-        sql = 'select distinct rv_author from revision where rv_repo_url = $url'
-        params = {'url': repo_url}
-        cursor.execute(sql, params)
-        return [r[0] for r in cursor.fetchall()]
+    def _authors_aggregate(self):
+        """Aggregate of (author id, author name) pairs."""
+        return Aggregate('''
+            select au.au_id, au.au_name
+            from author au
+            where au.au_id in (
+                select ad.au_id
+                from author_day ad
+                join repository rp on rp.rp_id = ad.rp_id
+                where rp.rp_url = $url
+            )
+        ''', {'url': self.repo_url})
+
+    def _author_days_aggregate(self):
+        """Aggregate of (author id, day, number of commits) of all
+        author_day rollups, sorted by author and day.
+        """
+        return Aggregate('''
+            select ad.au_id, ad.ad_day, ad.ad_commits
+            from author_day ad
+            join repository rp on rp.rp_id = ad.rp_id
+            where rp.rp_url = $url
+            order by ad.au_id, ad.ad_day
+        ''', {'url': self.repo_url})
 
-    def _get_data(self, repo_url, cursor, authors, date_range):
-        """Return list of (author, date, count) triplets."""
+    def get_aggregates(self):
+        aggregates = [revision_summary(self.repo_url), self._authors_aggregate()]
+        if self.date_range == 'all':
+            # windows of graphs of last month and week are shorter than
+            # min_rollup_span, see _get_data
+            aggregates.append(self._author_days_aggregate())
+        return aggregates
+
+    def _get_data(self, aggregates, authors, date_range):
+        """Return list of (author, date, count) triplets.
+        date_range is pair of seconds since epoch.
+
+        Commit times of all authors are sorted by author and time, and
+        the window is moved over each author's commits with two
+        pointers. Windows of min_rollup_span or longer are counted from
+        author_day rollups of whole history (commits of a day are
+        counted at its beginning), shorter ones from revisions in
+        date_range.
+        """
 
         no_of_steps = 100
-        seconds_in_day = 60 * 60 * 24
-        def timedelta_to_seconds(t): return t.seconds + t.microseconds / 1000000 + t.days * seconds_in_day
-        step = datetime.timedelta(
-            seconds=(timedelta_to_seconds(date_range[1] - date_range[0])/no_of_steps)
-        )
+        step = (date_range[1] - date_range[0]) / no_of_steps
         span = step * 5
-        span_days = timedelta_to_seconds(step) / seconds_in_day
 
         def generate_dates(d1, d2, step):
             d = d1
@@ -333,77 +829,84 @@ class CommitsByAuthorsGraphReport(Report):
                 yield d
                 d += step
 
-        def get_author_data(author):
-            cursor.execute('''
-                select min(rv_timestamp), max(rv_timestamp)
-                from revision where rv_repo_url = $url
-                and rv_author = $author
-                and rv_timestamp >= $mindate and rv_timestamp <= $maxdate
-            ''', {'url': repo_url, 'author': author,
-                'mindate': date_range[0], 'maxdate': date_range[1]})
-            mindate, maxdate = map(ensure_date, cursor.fetchone())
-            if mindate is None and maxdate is None: return []
-#            print "date range: %s %s" % (repr(mindate), repr(maxdate))
+        if span >= self.min_rollup_span:
+            mindate, maxdate = epoch_day(date_range[0]), date_range[1]
+            rows = [row for row in
+                aggregates.get_rows(self._author_days_aggregate())
+                if mindate <= row[1] <= maxdate]
+        else:
+            rows = aggregates.get_rows(Aggregate('''
+                select rv.au_id, rv.rv_epoch, 1
+                from revision rv
+                join repository rp on rp.rp_id = rv.rp_id
+                where rp.rp_url = $url
+                and rv.rv_epoch >= $mindate and rv.rv_epoch <= $maxdate
+                order by rv.au_id, rv.rv_epoch
+            ''', {'url': self.repo_url,
+                'mindate': date_range[0], 'maxdate': date_range[1]}))
+        commits_by_author = {}
+        for author_id, rows in itertools.groupby(rows, operator.itemgetter(0)):
+            commits_by_author[author_id] = [(t, n) for a, t, n in rows]
+
+        def get_author_data(author, commits):
+            """commits is list of (time, number of commits) pairs."""
+            mindate, maxdate = commits[0][0], commits[-1][0]
             author_data = []
             dates = list(generate_dates(mindate + step, maxdate, step))
             if maxdate not in dates: dates.append(maxdate)
+            # window (date - span, date] holds commits[first:last]
+            first = last = 0
+            cnt = 0
             for date in dates:
                 t1 = date - span
                 t2 = date
-                cursor.execute('''
-                    select count(*)
-                    from revision
-                    where rv_repo_url = $url
-                    and rv_author = $author
-                    and rv_timestamp > $t1
-                    and rv_timestamp <= $t2
-                ''', {'t1': t1, 't2': t2,
-                    'url': repo_url, 'author': author,})
-                    #'mindate': date_range[0], 'maxdate': date_range[1]})
-                cnt = cursor.fetchone()[0]
+                while last < len(commits) and commits[last][0] <= t2:
+                    cnt += commits[last][1]
+                    last += 1
+                while first < last and commits[first][0] <= t1:
+                    cnt -= commits[first][1]
+                    first += 1
                 if cnt:
-                    a = cnt / (timedelta_to_seconds(t2-t1)/seconds_in_day)
-                    author_data.append((author, date, a))
-                elif cnt == 0:
-                    author_data.append((author, date, 0))
+                    a = cnt / ((t2 - t1) / SECONDS_IN_DAY)
+                    author_data.append((author, epoch_to_datetime(date), a))
                 else:
-                    raise Exception()
+                    author_data.append((author, epoch_to_datetime(date), 0))
             return author_data
 
         data = []
-        for author in authors:
-            data += get_author_data(author)
+        for author_id, author in authors:
+            if author_id in commits_by_author:
+                data += get_author_data(author, commits_by_author[author_id])
         return data
 
-    def get_date_range(self, cursor):
-        cursor.execute('''
-            select max(rv_timestamp), min(rv_timestamp)
-            from revision
-            where rv_repo_url = $url
-        ''', {'url': self.repo_url})
-        maxdate, mindate = map(ensure_date, cursor.fetchone())
+    def get_date_range(self, aggregates):
+        """Return (first, last) revision time, in seconds since epoch."""
+        mindate, maxdate = aggregates.get_rows(revision_summary(self.repo_url))[0][3:5]
         if self.date_range == 'month':
-            mindate = max(mindate, maxdate - datetime.timedelta(days=30))
+            mindate = max(mindate, maxdate - 30 * SECONDS_IN_DAY)
         elif self.date_range == 'week':
-            mindate = max(mindate, maxdate - datetime.timedelta(days=7))
+            mindate = max(mindate, maxdate - 7 * SECONDS_IN_DAY)
         return mindate, maxdate
 
-    def generate(self, cursor, options, format='html', with_links=True):
-        graph = svg.Graph()
+    def generate_fragments(self, cursor, options, format='html',
+            with_links=True, aggregates=None):
+        if aggregates is None:
+            aggregates = AggregateResults(cursor)
+        graph = svg.Graph(graph_id=self.name)
         graph.ox_axis_title = 'Date'
         graph.oy_axis_title = 'Count'
         graph.add_series('foo')
-        mindate, maxdate = self.get_date_range(cursor)
-        authors = self._get_authors(self.repo_url, cursor)
-        for author in authors:
+        mindate, maxdate = self.get_date_range(aggregates)
+        authors = aggregates.get_rows(self._authors_aggregate())
+        for author_id, author in authors:
             graph.add_series(author)
         graph.randomize_series_colors()
-        for author, date, count in self._get_data(self.repo_url, cursor, authors, (mindate, maxdate)):
+        for author, date, count in self._get_data(aggregates, authors, (mindate, maxdate)):
             graph.add_value(author, date, count)
         s = StringIO()
         graph.render_to_stream(s, standalone=False)
         svg_content = s.getvalue()
-        return """
+        return ["""
             <div class="report">
                 <a id="%(anchor_name)s"></a>
                 <h2>%(title)s</h2>
@@ -415,5 +918,5 @@ class CommitsByAuthorsGraphReport(Report):
             'anchor_name': self.name,
             'go_to_top_link': self.go_to_top_link(with_links),
             'svg_content': svg_content,
-        }
+        }]
 
@@ -31,7 +31,8 @@ class Graph:
     def __init__(self, width=900, height=400,
             margin=20,
             ox_axis_title='',
-            oy_axis_title=''):
+            oy_axis_title='',
+            graph_id=None):
         self.width = float(width)
         self.height = float(height)
         self.margin = float(margin)
@@ -40,8 +41,12 @@ class Graph:
         self.series_colors = {}
         self.data = {}
         self.series = set()
-        self.local_graph_id = Graph.static_graph_count
-        Graph.static_graph_count += 1
+        # svg element ids must be unique in page, graphs generated
+        # elsewhere (other process, earlier run) need explicit id
+        if graph_id is None:
+            graph_id = Graph.static_graph_count
+            Graph.static_graph_count += 1
+        self.local_graph_id = graph_id
 
     def add_series(self, series_name):
         self.series.add(series_name)
@@ -80,7 +85,7 @@ class Graph:
 #        """, {'series_color': self.get_series_color(series_name)}))
         stream.write("""\
             <svg:defs>
-                <svg:path id="path_%(graph_id)d_%(series_name)s"
+                <svg:path id="path_%(graph_id)s_%(series_name)s"
                         fill="none" stroke="%(series_color)s" 
                         stroke-width="1.5"
             """  % {'graph_id': self.local_graph_id,
@@ -98,7 +103,7 @@ class Graph:
         stream.write('"/>\n')
         stream.write('</svg:defs>\n');
 
-        stream.write("""<svg:use xlink:href="#path_%(graph_id)d_%(series_name)s"/>""" % {
+        stream.write("""<svg:use xlink:href="#path_%(graph_id)s_%(series_name)s"/>""" % {
                 'graph_id': self.local_graph_id,
                 'series_name': series_name,
                 'series_title': series_name})
@@ -109,7 +114,7 @@ class Graph:
                         fill="black"
                         dy="-1pt">
                     <svg:textPath
-                        xlink:href="#path_%(graph_id)d_%(series_name)s"
+                        xlink:href="#path_%(graph_id)s_%(series_name)s"
                     >%(series_title)s</svg:textPath>
                 </svg:text>
             """ % {
@@ -65,6 +65,14 @@ class Connection:
     def commit(self):
         return self.conn.commit()
 
+    def begin_bulk_load(self):
+        """Prepare database for loading lots of data."""
+        pass
+
+    def end_bulk_load(self):
+        """Restore normal settings after bulk load."""
+        pass
+
 
 
 class SQLiteConnection(Connection):
@@ -72,10 +80,24 @@ class SQLiteConnection(Connection):
         Connection.__init__(self, 'sqlite', module, conn)
 
     def table_exists(conn, table_name):
+        return conn._object_exists('table', table_name)
+
+    def index_exists(conn, index_name):
+        return conn._object_exists('index', index_name)
+
+    def view_exists(conn, view_name):
+        return conn._object_exists('view', view_name)
+
+    def column_exists(conn, table_name, column_name):
+        curs = conn.cursor()
+        curs.execute('pragma table_info(%s)' % table_name)
+        return column_name in [row[1] for row in curs.fetchall()]
+
+    def _object_exists(conn, type, name):
         curs = conn.cursor()
         curs.execute(
             'select count(*) from sqlite_master where type = $type and name = $name',
-            {'type': 'table', 'name': table_name})
+            {'type': type, 'name': name})
         c = curs.fetchone()[0]
         if c == 0:
             return False
@@ -83,6 +105,22 @@ class SQLiteConnection(Connection):
             return True
         else:
             raise SQLException()
+
+    def begin_bulk_load(self):
+        """Turn off journal and syncing, use big cache.
+        Database may be corrupted if bulk load is interrupted.
+        """
+        curs = self.cursor()
+        curs.execute('pragma journal_mode = off')
+        curs.execute('pragma synchronous = off')
+        curs.execute('pragma cache_size = 100000')
+        curs.execute('pragma temp_store = memory')
+
+    def end_bulk_load(self):
+        curs = self.cursor()
+        curs.execute('analyze')
+        curs.execute('pragma journal_mode = delete')
+        curs.execute('pragma synchronous = full')
     
 
 class Cursor:
@@ -100,6 +138,23 @@ class Cursor:
             return self.cursor.execute(sql, params)
         else:
             return self.cursor.execute(sql)
+
+    def executemany(self, sql, params_seq):
+        """Execute sql once for every params dict in params_seq.
+
+        Placeholders are converted only once, and rows are handed to
+        the driver in one executemany call.
+        """
+        params_seq = list(params_seq)
+        if not params_seq:
+            return None
+        if self.conn.paramstyle == 'qmark':
+            names = [match[1] for match in self.re_placeholder_re.findall(sql)]
+            sql = self.re_placeholder_re.sub(r'?', sql)
+            params_seq = [[params[name] for name in names] for params in params_seq]
+        else:
+            sql, params = self._convert_command(sql, params_seq[0])
+        return self.cursor.executemany(sql, params_seq)
     
     def _convert_command(self, sql, params):
         converters = {